@@ -1,12 +1,21 @@
 # -*- coding: utf-8 -*-
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
 import os
 from pathlib import Path
 import json
 import logging
-from main import generate_book
+import threading
+from main import BUILD_ROOT, generate_book_auto, ensure_pdf, find_resumable, is_valid_theme, purge_stale_builds, resume_book
+from batch import load_batch, run_batch
+from utils.job_queue import JobQueue
+from utils.catalog import get_catalog
+from utils.image_variants import VARIANT_FORMATS, get_variant, negotiate_format, render_variant, snap_width
+from utils.http_cache import send_cached_file
+from utils.metrics import get_metrics
+from werkzeug.utils import safe_join
 import shutil
+from urllib.parse import quote
 
 app = Flask(__name__)
 CORS(app)  # 允许跨域请求
@@ -19,9 +28,93 @@ logger = logging.getLogger(__name__)
 BOOKS_DIR = Path("books")
 BOOKS_DIR.mkdir(parents=True, exist_ok=True)
 
+# 绘本目录索引（启动时与磁盘对账一次，之后随生成/删除增量更新）
+catalog = get_catalog(BOOKS_DIR)
+
+_startup_lock = threading.Lock()
+_started = False
+
+def startup():
+    """服务启动时执行一次：目录索引与磁盘对账、清理上次中断残留的构建目录
+
+    不在模块导入时执行：CPU进程池以spawn方式启动的子进程会以 __mp_main__ 重新导入本模块，
+    子进程中不能重复扫描目录，更不能清理主进程正在使用的构建目录
+    """
+    global _started
+    with _startup_lock:
+        if _started:
+            return
+        catalog.sync()
+        purge_stale_builds()
+        _started = True
+
+@app.before_request
+def _ensure_started():
+    """以WSGI服务器等方式加载时，在处理第一个请求前完成启动步骤"""
+    if not _started:
+        startup()
+
+# 列表分页配置
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+# 后台生成任务队列（并发数由 BOOK_WORKERS 环境变量配置）
+job_queue = JobQueue()
+
+# 任务数仪表（/metrics 导出时采集）
+get_metrics().register_gauge(
+    "jobs", "内存中的生成任务数（按状态）",
+    lambda: [({"status": status}, count) for status, count in job_queue.counts().items()]
+)
+get_metrics().register_gauge(
+    "jobs_inflight", "排队中与执行中的生成任务数",
+    lambda: [({}, sum(job_queue.counts()[status] for status in ("queued", "running")))]
+)
+
+# 事件流无新事件时发送心跳的间隔（秒），防止代理断开空闲连接
+SSE_KEEPALIVE = int(os.getenv("SSE_KEEPALIVE", 15))
+
+def _book_payload(theme):
+    """读取已生成绘本的目录信息"""
+    book_dir = BOOKS_DIR / theme
+    metadata_path = book_dir / "metadata.json"
+    if not metadata_path.exists():
+        return None
+
+    with open(metadata_path, "r", encoding="utf-8") as f:
+        metadata = json.load(f)
+
+    # 获取生成的图片列表
+    image_files = [f.name for f in book_dir.glob("page_*.png")]
+    image_files.sort()
+
+    # PDF在首次下载时按需生成，有页面即可下载
+    has_pdf = bool(image_files)
+
+    return {
+        "book_dir": theme,
+        "images": image_files,
+        "metadata": metadata,
+        "has_pdf": has_pdf
+    }
+
+def _flag(value, default=False):
+    """解析请求中的布尔参数（JSON布尔值、数字或 "true"/"false"/"1"/"0" 字符串）"""
+    if value is None:
+        return default
+    if isinstance(value, str):
+        return value.strip().lower() in ("1", "true", "yes", "on")
+    return bool(value)
+
+def _generate_job(params, progress_callback=None, **kwargs):
+    """后台任务：生成绘本并返回结果"""
+    if not generate_book_auto(params, progress_callback=progress_callback, **kwargs):
+        return None
+    return _book_payload(params["theme"])
+
 @app.route('/api/generate', methods=['POST'])
 def api_generate_book():
-    """处理绘本生成请求"""
+    """处理绘本生成请求（异步入队，立即返回任务ID）"""
     try:
         # 获取请求参数
         data = request.json
@@ -29,101 +122,301 @@ def api_generate_book():
         style = data.get('style', '')
         page_count = int(data.get('page_count', 3))
 
-        if not theme or page_count <= 0:
+        if not theme.strip() or page_count <= 0:
             return jsonify({"success": False, "message": "参数无效"}), 400
+        if not is_valid_theme(theme.strip()):
+            return jsonify({"success": False, "message": "主题不能包含“/”“\\”“..”，也不能以“.”开头"}), 400
 
         # 生成绘本
         book_params = {
-            "theme": theme,
-            "style": style,
+            "theme": theme.strip(),
+            "style": style.strip(),
             "page_count": page_count
         }
+        use_cache = not _flag(data.get('no_cache'))
 
-        # 调用主程序生成绘本
-        generate_book(book_params)
+        # 提交到后台任务队列（no_cache=true 时跳过故事缓存）；
+        # 参数相同的请求在任务结束前复用同一任务，不重复生成
+        key = json.dumps([book_params, use_cache], sort_keys=True, ensure_ascii=False)
+        job_id, deduplicated = job_queue.submit_once(_generate_job, book_params, key=key, use_cache=use_cache)
 
-        # 读取元数据
-        book_dir = BOOKS_DIR / theme
-        metadata_path = book_dir / "metadata.json"
+        return jsonify({
+            "success": True,
+            "job_id": job_id,
+            "status": job_queue.get(job_id)["status"],
+            "deduplicated": deduplicated
+        }), 202
 
-        if not metadata_path.exists():
-            return jsonify({"success": False, "message": "生成失败，请重试"}), 500
+    except Exception as e:
+        logger.error(f"提交生成任务失败: {str(e)}")
+        return jsonify({"success": False, "message": f"生成失败: {str(e)}"}), 500
 
-        with open(metadata_path, "r", encoding="utf-8") as f:
-            metadata = json.load(f)
+def _batch_job(params, progress_callback=None, event_callback=None, **kwargs):
+    """后台任务：批量生成绘本并返回汇总报告"""
+    return run_batch(params["books"], progress_callback=progress_callback,
+                     event_callback=event_callback, **kwargs)
 
-        # 获取生成的图片列表
-        image_files = [f.name for f in book_dir.glob("page_*.png")]
-        image_files.sort()
+@app.route('/api/generate/batch', methods=['POST'])
+def api_generate_batch():
+    """批量生成绘本（作为一个后台任务执行，进度按绘本计数，结果为汇总报告）
 
-        # 检查PDF文件是否存在
-        pdf_path = book_dir / "book.pdf"
-        has_pdf = pdf_path.exists()
+    请求体可以是参数数组、{"books": [...], "no_cache": false, "skip_completed": true}，
+    或JSONL文本（每行一个 {"theme", "style", "page_count"}）
+    """
+    try:
+        data = request.get_json(silent=True)
+        if data is None:
+            data = load_batch(request.get_data(as_text=True))
+        options = data if isinstance(data, dict) else {}
+        books = options.get("books", []) if isinstance(data, dict) else data
+
+        if not isinstance(books, list) or not books:
+            return jsonify({"success": False, "message": "参数无效"}), 400
+
+        job_id = job_queue.submit(
+            _batch_job,
+            {"books": books},
+            total=len(books),
+            skip_completed=_flag(options.get("skip_completed"), default=True),
+            use_cache=not _flag(options.get("no_cache")),
+        )
 
         return jsonify({
             "success": True,
-            "book_dir": theme,
-            "images": image_files,
-            "metadata": metadata,
-            "has_pdf": has_pdf
-        })
+            "job_id": job_id,
+            "status": "queued",
+            "total": len(books)
+        }), 202
 
+    except ValueError as e:
+        return jsonify({"success": False, "message": f"请求格式错误: {str(e)}"}), 400
     except Exception as e:
-        logger.error(f"生成失败: {str(e)}")
+        logger.error(f"提交批量任务失败: {str(e)}")
         return jsonify({"success": False, "message": f"生成失败: {str(e)}"}), 500
 
+def _repair_job(params, progress_callback=None, **kwargs):
+    """后台任务：补齐绘本缺失或失败的页面并返回结果"""
+    if not resume_book(params["theme"], progress_callback=progress_callback, **kwargs):
+        return None
+    return _book_payload(params["theme"])
+
+@app.route('/api/books/<theme>/repair', methods=['POST'])
+def repair_book(theme):
+    """续跑/修复绘本：复用已生成的故事，只重新生成缺失或失败的页面与PDF（异步任务）"""
+    if not is_valid_theme(theme):
+        return jsonify({"success": False, "message": "没有可修复的绘本"}), 404
+    book_dir, _ = find_resumable(theme)
+    if book_dir is None:
+        return jsonify({"success": False, "message": "没有可修复的绘本"}), 404
+
+    with open(book_dir / "metadata.json", "r", encoding="utf-8") as f:
+        params = json.load(f)["params"]
+    job_id, deduplicated = job_queue.submit_once(_repair_job, params, key=f"repair:{theme}")
+
+    return jsonify({
+        "success": True,
+        "job_id": job_id,
+        "status": job_queue.get(job_id)["status"],
+        "deduplicated": deduplicated
+    }), 202
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """查询生成任务状态、每页进度与最终结果"""
+    job = job_queue.get(job_id)
+    if not job:
+        return jsonify({"success": False, "message": "任务不存在"}), 404
+    return jsonify({"success": True, "job": job})
+
+@app.route('/api/jobs', methods=['GET'])
+def list_jobs():
+    """列出所有生成任务"""
+    return jsonify({"success": True, "jobs": job_queue.list()})
+
+def _sse_message(event, theme, job_id):
+    """将任务事件格式化为SSE消息，页面完成与绘本完成事件附带可直接访问的URL
+
+    发布前页面位于任务的构建目录，页面URL指向任务图片接口；book_ready 附带正式绘本地址，前端据此切换
+    """
+    data = dict(event["data"])
+    book_url = f"/api/books/{quote(theme, safe='')}"
+    if event["event"] == "page" and data.get("filename"):
+        data["url"] = f"/api/jobs/{quote(job_id, safe='')}/images/{quote(data['filename'])}"
+    elif event["event"] == "book_ready":
+        data["book_url"] = book_url
+        data["pdf_url"] = f"{book_url}/pdf"
+    payload = json.dumps(data, ensure_ascii=False)
+    return f"id: {event['id']}\nevent: {event['event']}\ndata: {payload}\n\n"
+
+@app.route('/api/jobs/<job_id>/events', methods=['GET'])
+def stream_job_events(job_id):
+    """以SSE推送任务事件：status、story_ready、page（每页状态，完成时带图片URL）、book_ready、done；
+    批量任务推送 page（按绘本序号）与 book_done
+
+    断线重连时浏览器携带 Last-Event-ID，从该事件之后继续推送；收到 done 事件后服务端关闭连接
+    """
+    job = job_queue.get(job_id)
+    if not job:
+        return jsonify({"success": False, "message": "任务不存在"}), 404
+    theme = job["params"].get("theme", "")
+    last_event_id = request.headers.get('Last-Event-ID', 0, type=int)
+
+    def stream():
+        cursor = last_event_id
+        while True:
+            batch = job_queue.wait_events(job_id, after=cursor, timeout=SSE_KEEPALIVE)
+            if batch is None:
+                return
+            events, finished = batch
+            if not events and not finished:
+                yield ": keepalive\n\n"
+            for event in events:
+                cursor = event["id"]
+                yield _sse_message(event, theme, job_id)
+            if finished:
+                return
+
+    return Response(stream_with_context(stream()), mimetype="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",  # 关闭nginx缓冲，事件立即送达
+    })
+
+def _conditional_json(payload):
+    """返回带ETag的JSON响应，客户端携带匹配的If-None-Match时返回304"""
+    response = jsonify(payload)
+    response.add_etag()
+    # 允许浏览器缓存，但每次使用前必须重新验证
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
 @app.route('/api/books', methods=['GET'])
 def list_books():
-    """列出所有已生成的绘本"""
+    """分页列出已生成的绘本摘要（读取目录索引，不扫描磁盘）
+
+    每本绘本仅返回 theme、style、page_count、cover、has_pdf、updated_at，
+    完整元数据请使用 /api/books/<theme>
+
+    查询参数：page、page_size、sort(updated_at/created_at/theme/style/page_count)、
+    order(asc/desc)、theme（模糊匹配）、style（精确匹配）
+    """
     try:
-        books = []
-        # 检查books目录是否存在
-        if not BOOKS_DIR.exists() or not BOOKS_DIR.is_dir():
-            logger.warning(f"绘本目录不存在: {BOOKS_DIR}")
-            return jsonify({"success": True, "books": []})
-
-        for book_dir in BOOKS_DIR.iterdir():
-            if book_dir.is_dir():
-                try:
-                    metadata_path = book_dir / "metadata.json"
-                    if metadata_path.exists():
-                        with open(metadata_path, "r", encoding="utf-8") as f:
-                            metadata = json.load(f)
-
-                        image_files = [f.name for f in book_dir.glob("page_*.png")]
-                        image_files.sort()
-
-                        pdf_path = book_dir / "book.pdf"
-                        has_pdf = pdf_path.exists()
-
-                        books.append({
-                            "theme": book_dir.name,
-                            "images": image_files,
-                            "metadata": metadata,
-                            "has_pdf": has_pdf
-                        })
-                except Exception as inner_e:
-                    # 记录单本绘本的错误，但继续处理其他绘本
-                    logger.error(f"处理绘本 {book_dir.name} 时出错: {str(inner_e)}")
-                    continue
-
-        return jsonify({"success": True, "books": books})
+        page = max(1, request.args.get('page', 1, type=int))
+        page_size = min(MAX_PAGE_SIZE, max(1, request.args.get('page_size', DEFAULT_PAGE_SIZE, type=int)))
+
+        total, books = catalog.query(
+            page=page,
+            page_size=page_size,
+            sort=request.args.get('sort', 'updated_at'),
+            order=request.args.get('order', 'desc'),
+            theme=request.args.get('theme'),
+            style=request.args.get('style')
+        )
+
+        return _conditional_json({
+            "success": True,
+            "books": books,
+            "total": total,
+            "page": page,
+            "page_size": page_size
+        })
 
     except Exception as e:
         logger.error(f"获取绘本列表失败: {str(e)}")
         return jsonify({"success": False, "message": f"获取绘本列表失败: {str(e)}"}), 500
 
+@app.route('/api/books/<theme>', methods=['GET'])
+@app.route('/api/books/<theme>/metadata', methods=['GET'])
+def get_book(theme):
+    """获取单本绘本的完整元数据与图片列表（内存缓存，绘本目录变化时自动刷新）"""
+    book = catalog.detail(theme)
+    if not book:
+        return jsonify({"success": False, "message": "绘本不存在"}), 404
+    return _conditional_json({"success": True, **book})
+
 @app.route('/api/books/<theme>/images/<filename>', methods=['GET'])
 def get_book_image(theme, filename):
-    """获取绘本图片"""
-    book_dir = BOOKS_DIR / theme
-    return send_from_directory(book_dir, filename)
+    """获取绘本图片
+
+    查询参数 w 指定宽度时返回缩放后的派生图，fmt 可选 webp/jpeg/auto（默认auto，按Accept头协商）；
+    带版本参数 v 时返回长期缓存头
+    """
+    image_path = safe_join(str(BOOKS_DIR), theme, filename)
+    if not image_path or not filename.startswith("page_"):
+        return jsonify({"success": False, "message": "图片不存在"}), 404
+    try:
+        return _send_book_image(theme, filename, image_path)
+    except FileNotFoundError:
+        if not catalog.wait_published(theme):
+            return jsonify({"success": False, "message": "图片不存在"}), 404
+    # 发布替换目录期间页面暂时缺失：持有发布锁重试一次，期间目录不会再被替换
+    with catalog.publish_lock(theme):
+        try:
+            return _send_book_image(theme, filename, image_path)
+        except FileNotFoundError:
+            return jsonify({"success": False, "message": "图片不存在"}), 404
+
+def _send_book_image(theme, filename, image_path):
+    """发送绘本页面原图或派生图，页面不存在时抛出 FileNotFoundError"""
+    if not os.path.isfile(image_path):
+        raise FileNotFoundError(image_path)
+
+    immutable = 'v' in request.args
+    width = request.args.get('w', type=int)
+    if not width:
+        return send_cached_file(image_path, immutable=immutable)
+
+    fmt = negotiate_format(request.args.get('fmt', 'auto'), request.headers.get('Accept', ''))
+    variant = get_variant(BOOKS_DIR / theme, filename, snap_width(width), fmt)
+    response = send_cached_file(variant, mimetype=VARIANT_FORMATS[fmt][2], immutable=immutable)
+    response.vary.add('Accept')
+    return response
+
+@app.route('/api/jobs/<job_id>/images/<filename>', methods=['GET'])
+def get_job_image(job_id, filename):
+    """获取任务已完成的页面图片（SSE page 事件中的URL），参数同绘本图片接口（不支持 v）
+
+    发布前从任务的构建目录读取，派生图在内存中生成、不写入构建目录；
+    构建目录已发布或不存在时（如原地修复）回退到正式绘本目录
+    """
+    job = job_queue.get(job_id)
+    if not job or not filename.startswith("page_"):
+        return jsonify({"success": False, "message": "图片不存在"}), 404
+
+    build = job_queue.last_event(job_id, "build_started")
+    if build:
+        image_path = safe_join(str(BUILD_ROOT), build["build_id"], filename)
+        try:
+            if image_path and os.path.isfile(image_path):
+                width = request.args.get('w', type=int)
+                if not width:
+                    return send_cached_file(image_path)
+                fmt = negotiate_format(request.args.get('fmt', 'auto'), request.headers.get('Accept', ''))
+                response = Response(render_variant(image_path, snap_width(width), fmt),
+                                    mimetype=VARIANT_FORMATS[fmt][2])
+                response.cache_control.no_cache = True
+                response.vary.add('Accept')
+                return response
+        except FileNotFoundError:
+            # 读取期间构建目录被发布（或丢弃），改从正式目录读取
+            pass
+    return get_book_image(job["params"].get("theme", ""), filename)
 
 @app.route('/api/books/<theme>/pdf', methods=['GET'])
 def get_book_pdf(theme):
-    """获取绘本PDF"""
-    book_dir = BOOKS_DIR / theme
-    return send_from_directory(book_dir, "book.pdf")
+    """获取绘本PDF（首次请求或页面/元数据变更后按需生成）
+
+    支持Range分段下载与条件请求；带版本参数 v 时返回长期缓存头
+    """
+    book_path = safe_join(str(BOOKS_DIR), theme)
+    if not book_path or not catalog.wait_published(theme):
+        return jsonify({"success": False, "message": "绘本不存在"}), 404
+
+    # 持有发布锁直到打开文件（已打开的文件在目录被替换后仍可读取），构建与发送期间目录不会被换走
+    with catalog.publish_lock(theme):
+        pdf_path = ensure_pdf(book_path)
+        if not pdf_path:
+            return jsonify({"success": False, "message": "PDF生成失败，请重试"}), 500
+        return send_cached_file(pdf_path, mimetype="application/pdf", immutable='v' in request.args)
 
 @app.route('/api/books/<theme>', methods=['DELETE'])
 def delete_book(theme):
@@ -131,11 +424,14 @@ def delete_book(theme):
     try:
         book_dir = BOOKS_DIR / theme
 
-        if not book_dir.exists() or not book_dir.is_dir():
-            return jsonify({"success": False, "message": "绘本不存在"}), 404
+        # 与发布互斥：等待进行中的发布完成后再删除，读取方在删除完成前不会把目录缺失当作已删除
+        with catalog.publish_lock(theme):
+            if not book_dir.exists() or not book_dir.is_dir():
+                return jsonify({"success": False, "message": "绘本不存在"}), 404
 
-        # 删除整个目录
-        shutil.rmtree(book_dir)
+            # 删除整个目录
+            shutil.rmtree(book_dir)
+            catalog.remove(theme)
 
         return jsonify({"success": True, "message": f"已成功删除绘本: {theme}"})
 
@@ -143,5 +439,13 @@ def delete_book(theme):
         logger.error(f"删除绘本失败: {str(e)}")
         return jsonify({"success": False, "message": f"删除失败: {str(e)}"}), 500
 
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """以Prometheus文本格式导出各阶段耗时直方图、重试次数与任务数"""
+    return Response(get_metrics().render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
 if __name__ == '__main__':
+    # 调试模式下由重载器拉起的子进程提供服务，监视文件的父进程无需执行启动步骤（未执行时由首个请求触发）
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        startup()
     app.run(debug=True, host='0.0.0.0', port=5001)
\ No newline at end of file
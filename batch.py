@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+"""批量生成绘本
+
+用法：
+    python batch.py themes.jsonl                    # 每行一个 {"theme", "style", "page_count"}
+    python batch.py themes.json --concurrency 4     # 也可以是JSON数组
+    cat themes.jsonl | python batch.py -            # 从标准输入读取
+
+    python batch.py --repair 森林冒险 海底世界         # 只补齐指定绘本缺失/失败的页面
+
+已完成的绘本（元数据参数一致且页面齐全）默认跳过；部分完成或中断的绘本复用已生成的故事，
+只重新生成缺失的页面，中断后重新执行同一命令即可续跑；
+每完成一本即更新汇总报告（默认写入 books/.batch/report-<时间>.json）
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import threading
+from pathlib import Path
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+from main import find_resumable, generate_book_auto, is_valid_theme, resume_book
+
+logger = logging.getLogger(__name__)
+
+# 同时生成的绘本数（各绘本的接口请求共享 utils.rate_limit 中的全局名额）
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", 4))
+# 汇总报告目录
+BATCH_REPORT_DIR = Path(os.getenv("BATCH_REPORT_DIR", "books/.batch"))
+# 未指定页数时的默认值（与 /api/generate 一致）
+DEFAULT_PAGE_COUNT = 3
+
+
+def load_batch(text):
+    """解析批量请求：JSON数组，或每行一个JSON对象（JSONL，忽略空行与#开头的注释行）"""
+    text = text.strip()
+    if text.startswith("["):
+        return json.loads(text)
+    return [
+        json.loads(line) for line in text.splitlines()
+        if line.strip() and not line.lstrip().startswith("#")
+    ]
+
+
+def normalize_params(item):
+    """规范化单本绘本参数，无效时返回None"""
+    if not isinstance(item, dict) or not is_valid_theme(item.get("theme")):
+        return None
+    try:
+        page_count = int(item.get("page_count", DEFAULT_PAGE_COUNT))
+    except (TypeError, ValueError):
+        return None
+    if page_count <= 0:
+        return None
+    return {"theme": str(item["theme"]), "style": item.get("style", ""), "page_count": page_count}
+
+
+def count_pages(theme, books_dir="books"):
+    """已生成的页面数"""
+    return len(list((Path(books_dir) / theme).glob("page_*.png")))
+
+
+def _same_params(book_dir, params):
+    """目录中保存的生成参数与请求一致"""
+    try:
+        with open(Path(book_dir) / "metadata.json", "r", encoding="utf-8") as f:
+            saved = json.load(f).get("params", {})
+    except (OSError, ValueError):
+        return False
+    return saved.get("style", "") == params["style"] and saved.get("page_count") == params["page_count"]
+
+
+def is_book_complete(params, books_dir="books"):
+    """绘本已存在、生成参数一致且页面齐全"""
+    book_dir = Path(books_dir) / params["theme"]
+    if not _same_params(book_dir, params):
+        return False
+    return count_pages(params["theme"], books_dir) >= params["page_count"]
+
+
+def can_resume(params):
+    """存在参数一致、可复用故事续跑的绘本（部分完成或中断残留）"""
+    book_dir, _ = find_resumable(params["theme"])
+    return book_dir is not None and _same_params(book_dir, params)
+
+
+def _write_report(report, report_path):
+    """原子写入汇总报告"""
+    report_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = report_path.with_name(f".{report_path.name}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, report_path)
+
+
+def run_batch(items, concurrency=None, skip_completed=True, use_cache=True, report_path=None,
+              progress_callback=None, event_callback=None):
+    """并发生成多本绘本并返回汇总报告
+
+    progress_callback(index, status) 按绘本序号（从1开始）上报 running/done/failed，
+    event_callback("book_done", {...}) 在每本绘本结束（含跳过）时上报
+    每条结果的 status 取值：succeeded、partial（部分页面失败）、failed、skipped（已完成）、invalid（参数无效）；
+    resumed 表示复用了已生成的故事，只补齐缺失页面
+    """
+    report_path = Path(report_path or BATCH_REPORT_DIR / f"report-{datetime.now():%Y%m%d-%H%M%S}.json")
+    report = {
+        "started_at": time.time(),
+        "finished_at": None,
+        "total": len(items),
+        "summary": {},
+        "books": [None] * len(items),
+    }
+    report_lock = threading.Lock()
+
+    def record(index, entry):
+        with report_lock:
+            report["books"][index - 1] = entry
+            statuses = [book["status"] for book in report["books"] if book]
+            report["summary"] = {status: statuses.count(status) for status in sorted(set(statuses))}
+            _write_report(report, report_path)
+        if progress_callback:
+            progress_callback(index, "failed" if entry["status"] in ("failed", "invalid") else "done")
+        if event_callback:
+            event_callback("book_done", dict(entry, index=index))
+
+    def build(index, item):
+        params = normalize_params(item)
+        if params is None:
+            logger.warning(f"第{index}条参数无效，跳过：{item}")
+            record(index, {"theme": item.get("theme") if isinstance(item, dict) else None,
+                           "status": "invalid"})
+            return
+        if skip_completed and is_book_complete(params):
+            logger.info(f"绘本已完成，跳过：{params['theme']}")
+            record(index, {"theme": params["theme"], "status": "skipped",
+                           "pages_done": params["page_count"], "page_count": params["page_count"]})
+            return
+
+        if progress_callback:
+            progress_callback(index, "running")
+        started = time.time()
+        resumed = skip_completed and can_resume(params)
+        try:
+            if resumed:
+                book_dir = resume_book(params["theme"], use_cache=use_cache)
+            else:
+                book_dir = generate_book_auto(params, use_cache=use_cache)
+            error = None if book_dir else "生成失败"
+        except Exception as e:
+            book_dir, error = None, str(e)
+            logger.error(f"绘本生成异常 {params['theme']}: {error}")
+
+        pages_done = count_pages(params["theme"]) if book_dir else 0
+        if not book_dir:
+            status = "failed"
+        elif pages_done < params["page_count"]:
+            status = "partial"
+        else:
+            status = "succeeded"
+        record(index, {"theme": params["theme"], "status": status, "error": error, "resumed": resumed,
+                       "pages_done": pages_done, "page_count": params["page_count"],
+                       "elapsed": round(time.time() - started, 2)})
+
+    workers = max(1, concurrency or BATCH_CONCURRENCY)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="batch") as executor:
+        for future in [executor.submit(build, index, item) for index, item in enumerate(items, 1)]:
+            future.result()
+
+    report["finished_at"] = time.time()
+    report["report_path"] = str(report_path)
+    _write_report(report, report_path)
+    logger.info(f"批量生成结束：{report['summary']}，报告：{report_path}")
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="批量生成绘本")
+    parser.add_argument("source", nargs="?", help="JSONL或JSON数组文件路径，- 表示标准输入")
+    parser.add_argument("--repair", nargs="+", metavar="THEME", help="补齐指定绘本缺失或失败的页面（不调用大模型）")
+    parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY, help="同时生成的绘本数")
+    parser.add_argument("--report", help="汇总报告路径")
+    parser.add_argument("--no-skip", action="store_true", help="不跳过已完成的绘本")
+    parser.add_argument("--no-cache", action="store_true", help="跳过故事与图片缓存")
+    args = parser.parse_args(argv)
+
+    if args.repair:
+        failed = [theme for theme in args.repair if not resume_book(theme, use_cache=not args.no_cache)]
+        print(json.dumps({"repaired": [t for t in args.repair if t not in failed], "failed": failed},
+                         ensure_ascii=False))
+        return 1 if failed else 0
+    if not args.source:
+        parser.error("需要指定批量请求文件或 --repair")
+
+    if args.source == "-":
+        text = sys.stdin.read()
+    else:
+        text = Path(args.source).read_text(encoding="utf-8")
+
+    report = run_batch(load_batch(text), concurrency=args.concurrency, skip_completed=not args.no_skip,
+                       use_cache=not args.no_cache, report_path=args.report)
+    print(json.dumps({"summary": report["summary"], "report": report["report_path"]}, ensure_ascii=False))
+    return 0 if not {"failed", "partial"} & set(report["summary"]) else 1
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
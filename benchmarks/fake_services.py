@@ -0,0 +1,234 @@
+# benchmarks/fake_services.py
+"""方舟对话补全与火山引擎 CVProcess 的本地模拟服务（用于压测，不校验签名）
+
+    python -m benchmarks.fake_services --port 8900 --image-latency 0.5 --error-rate 0.05
+
+    ARK_BASE_URL=http://127.0.0.1:8900/api/v3
+    VOLC_ENDPOINT=http://127.0.0.1:8900
+"""
+import io
+import re
+import json
+import time
+import base64
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from PIL import Image
+
+# 模拟故事的可视化标签
+VISUAL_TAGS = {"colors": ["天蓝", "嫩绿"], "objects": ["小狐狸", "彩虹滑梯"]}
+
+
+class FakeConfig:
+    """模拟服务行为：固定延迟 + 随机抖动，按比例返回错误与限流"""
+
+    def __init__(self, text_latency=0.5, image_latency=1.0, jitter=0.2, error_rate=0.0,
+                 throttle_rate=0.0, retry_after=1, image_mode="base64", image_size=(1024, 768),
+                 stream_chunk_delay=0.01):
+        self.text_latency = text_latency
+        self.image_latency = image_latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.image_mode = image_mode
+        self.image_size = image_size
+        self.stream_chunk_delay = stream_chunk_delay
+        self.counters = {"text": 0, "image": 0, "download": 0, "errors": 0, "throttled": 0}
+        self._lock = threading.Lock()
+        self._png = None
+
+    def count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def delay(self, base):
+        time.sleep(max(0.0, base + random.uniform(-self.jitter, self.jitter) * base))
+
+    def png(self):
+        """模拟生成的图片（随机噪声，编码体积接近真实插图），只生成一次"""
+        if self._png is None:
+            width, height = self.image_size
+            image = Image.frombytes("RGB", (width, height), random.randbytes(width * height * 3))
+            buffer = io.BytesIO()
+            image.save(buffer, "PNG", compress_level=1)
+            self._png = buffer.getvalue()
+        return self._png
+
+
+def fake_story(page_count, theme="主题"):
+    """构造符合提示词格式的故事：可视化标签JSON + 每页【PAGE】段落（含「」对话）"""
+    pages = [
+        f"【PAGE】第{n}页，[小狐狸]在{theme}里遇见了[彩虹滑梯]。「我们一起去看看吧！」它开心地说。"
+        for n in range(1, page_count + 1)
+    ]
+    return json.dumps(VISUAL_TAGS, ensure_ascii=False) + "\n" + "\n".join(pages)
+
+
+def _page_count(messages):
+    """从用户提示词中读取页数"""
+    content = " ".join(message.get("content", "") for message in messages)
+    match = re.search(r"明确分为(\d+)个段落", content)
+    return int(match.group(1)) if match else 4
+
+
+def _theme(messages):
+    match = re.search(r"创作主题：(\S+)", " ".join(message.get("content", "") for message in messages))
+    return match.group(1) if match else "主题"
+
+
+def make_handler(config):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def handle(self):
+            # 客户端关闭空闲长连接属于正常情况
+            try:
+                super().handle()
+            except (ConnectionResetError, BrokenPipeError):
+                pass
+
+        def _json(self, status, payload, headers=None):
+            body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _fail_randomly(self):
+            """按配置比例返回限流（429 + Retry-After）或服务端错误，已响应时返回True"""
+            roll = random.random()
+            if roll < config.throttle_rate:
+                config.count("throttled")
+                self._json(429, {"error": {"message": "rate limited"}},
+                           {"Retry-After": str(config.retry_after)})
+                return True
+            if roll < config.throttle_rate + config.error_rate:
+                config.count("errors")
+                self._json(500, {"error": {"message": "internal error"}})
+                return True
+            return False
+
+        def do_GET(self):
+            if self.path.startswith("/images/"):
+                config.count("download")
+                data = config.png()
+                self.send_response(200)
+                self.send_header("Content-Type", "image/png")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+                return
+            self._json(404, {"error": "not found"})
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            payload = json.loads(self.rfile.read(length) or b"{}")
+            url = urlparse(self.path)
+            if url.path.endswith("/chat/completions"):
+                self._chat(payload)
+            elif parse_qs(url.query).get("Action") == ["CVProcess"]:
+                self._cv_process(payload)
+            else:
+                self._json(404, {"error": "not found"})
+
+        def _chat(self, payload):
+            config.count("text")
+            if self._fail_randomly():
+                return
+            messages = payload.get("messages", [])
+            content = fake_story(_page_count(messages), _theme(messages))
+            completion_id = f"chatcmpl-{random.getrandbits(48):x}"
+            if not payload.get("stream"):
+                config.delay(config.text_latency)
+                self._json(200, {
+                    "id": completion_id,
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": payload.get("model", "fake"),
+                    "choices": [{"index": 0, "finish_reason": "stop",
+                                 "message": {"role": "assistant", "content": content}}],
+                    "usage": {"prompt_tokens": 100, "completion_tokens": len(content), "total_tokens": 100 + len(content)},
+                })
+                return
+
+            # 流式：首包前等待部分延迟，其余按分片逐步输出
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            config.delay(config.text_latency * 0.2)
+            pieces = [content[i:i + 8] for i in range(0, len(content), 8)]
+            for index, piece in enumerate(pieces):
+                last = index == len(pieces) - 1
+                chunk = {
+                    "id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()),
+                    "model": payload.get("model", "fake"),
+                    "choices": [{"index": 0, "delta": {"content": piece},
+                                 "finish_reason": "stop" if last else None}],
+                }
+                self._chunk(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n")
+                time.sleep(config.stream_chunk_delay)
+            self._chunk("data: [DONE]\n\n")
+            self.wfile.write(b"0\r\n\r\n")
+
+        def _chunk(self, text):
+            data = text.encode("utf-8")
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+
+        def _cv_process(self, payload):
+            config.count("image")
+            if self._fail_randomly():
+                return
+            config.delay(config.image_latency)
+            if config.image_mode == "url":
+                host = self.headers.get("Host")
+                data = {"image_urls": [f"http://{host}/images/{random.getrandbits(32):x}.png"]}
+            else:
+                data = {"binary_data_base64": [base64.b64encode(config.png()).decode()]}
+            self._json(200, {"code": 10000, "message": "Success", "data": data})
+
+    return Handler
+
+
+def start(config=None, host="127.0.0.1", port=0):
+    """在后台线程启动模拟服务，返回 (server, base_url)"""
+    config = config or FakeConfig()
+    server = ThreadingHTTPServer((host, port), make_handler(config))
+    server.daemon_threads = True
+    server.config = config
+    threading.Thread(target=server.serve_forever, daemon=True, name="fake-services").start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="方舟/火山引擎本地模拟服务")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--text-latency", type=float, default=0.5, help="对话补全延迟（秒）")
+    parser.add_argument("--image-latency", type=float, default=1.0, help="图片生成延迟（秒）")
+    parser.add_argument("--jitter", type=float, default=0.2, help="延迟抖动比例")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回500的比例")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="返回429的比例")
+    parser.add_argument("--image-mode", choices=["base64", "url"], default="base64")
+    args = parser.parse_args()
+
+    config = FakeConfig(text_latency=args.text_latency, image_latency=args.image_latency, jitter=args.jitter,
+                        error_rate=args.error_rate, throttle_rate=args.throttle_rate, image_mode=args.image_mode)
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), make_handler(config))
+    print(f"ARK_BASE_URL=http://127.0.0.1:{args.port}/api/v3")
+    print(f"VOLC_ENDPOINT=http://127.0.0.1:{args.port}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,256 @@
+# benchmarks/run.py
+"""端到端性能基准：在本地模拟服务上测量绘本生成、PDF排版、文字叠加与HTTP接口
+
+    python -m benchmarks.run                                  # 全部场景
+    python -m benchmarks.run --scenarios generate pdf --books 8 --pages 4 --concurrency 4
+    python -m benchmarks.run --image-latency 0.2 --error-rate 0.05 --output report.json
+
+每个场景报告吞吐（次/秒）、p50/p95/p99 延迟与截至该场景结束的峰值内存（RSS）；
+限速、并发等参数沿用正式环境变量（如 IMAGE_API_QPS、PAGE_CONCURRENCY、CPU_WORKERS）
+"""
+import io
+import os
+import sys
+import json
+import math
+import time
+import shutil
+import logging
+import argparse
+import platform
+import resource
+import tempfile
+import contextlib
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+if str(REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(REPO_ROOT))
+
+from benchmarks.fake_services import FakeConfig, start  # noqa: E402
+
+SCENARIOS = ("generate", "pdf", "overlay", "http")
+
+
+def percentile(samples, pct):
+    """最近秩百分位数"""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    index = max(0, min(len(ordered) - 1, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def peak_rss_mb():
+    """本进程与已结束子进程（CPU进程池）的峰值RSS（MB）"""
+    scale = 1024 * 1024 if platform.system() == "Darwin" else 1024  # macOS 单位为字节，Linux 为KB
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 / scale
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024 / scale
+    return round(own / 1024, 1), round(children / 1024, 1)
+
+
+def measure(name, func, items, concurrency=1):
+    """对每个 item 调用 func（返回假值视为失败），汇总吞吐、延迟分位数与峰值内存"""
+    latencies, failures = [], 0
+
+    def timed(item):
+        started = time.perf_counter()
+        try:
+            ok = func(item)
+        except Exception as e:
+            logging.getLogger(__name__).error(f"{name} 执行异常：{e}")
+            ok = False
+        return time.perf_counter() - started, bool(ok)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix=f"bench-{name}") as executor:
+        for elapsed, ok in executor.map(timed, items):
+            latencies.append(elapsed)
+            failures += not ok
+    wall = time.perf_counter() - started
+
+    rss, children_rss = peak_rss_mb()
+    return {
+        "scenario": name,
+        "count": len(latencies),
+        "failures": failures,
+        "concurrency": concurrency,
+        "wall_seconds": round(wall, 3),
+        "throughput": round(len(latencies) / wall, 3) if wall else None,
+        "p50_ms": _ms(percentile(latencies, 50)),
+        "p95_ms": _ms(percentile(latencies, 95)),
+        "p99_ms": _ms(percentile(latencies, 99)),
+        "peak_rss_mb": rss,
+        "peak_children_rss_mb": children_rss,
+    }
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 1)
+
+
+def bench_generate(args, run_id):
+    """完整绘本生成（跳过缓存，每本使用不同主题）"""
+    from main import generate_book_auto
+
+    def build(index):
+        params = {"theme": f"bench-{run_id}-{index}", "style": "水彩", "page_count": args.pages}
+        return generate_book_auto(params, use_cache=False, stream=args.stream)
+
+    return measure("generate_book", build, range(args.books), args.concurrency)
+
+
+def _sample_book(run_id):
+    """取一本已生成的绘本（generate 场景未运行时先生成一本）"""
+    from main import BOOKS_ROOT, generate_book_auto
+    candidates = sorted(BOOKS_ROOT.glob(f"bench-{run_id}-*/metadata.json"))
+    if candidates:
+        return candidates[0].parent
+    return generate_book_auto({"theme": f"bench-{run_id}-sample", "style": "水彩", "page_count": 4}, use_cache=False)
+
+
+def bench_pdf(args, run_id, book_dir):
+    """PDF排版（直接调用 create_pdf，不经过 ensure_pdf 的新鲜度判断）"""
+    from main import create_pdf, split_pages
+    with open(book_dir / "metadata.json", encoding="utf-8") as f:
+        metadata = json.load(f)
+    pages = split_pages(metadata["raw_data"], metadata["params"]["page_count"])
+    return measure("create_pdf", lambda _: create_pdf(book_dir, pages), range(args.iterations))
+
+
+def bench_overlay(args, run_id, book_dir):
+    """单页文字叠加（每次在原始页面的副本上叠加）"""
+    from main import build_text_info
+    from generators.image_generator import VolcBookGenerator
+
+    scratch = Path(tempfile.mkdtemp(prefix="overlay-", dir="."))
+    generator = VolcBookGenerator(output_dir=scratch)
+    source = sorted(book_dir.glob("page_*.png"))[0]
+    text_info = build_text_info("小狐狸在森林里遇见了彩虹滑梯。「我们一起去看看吧！」它开心地说。")
+
+    def overlay(index):
+        target = scratch / f"page_{index:03d}.png"
+        shutil.copyfile(source, target)
+        return generator.add_text_overlay(str(target), text_info)
+
+    try:
+        return measure("add_text_overlay", overlay, range(args.iterations), args.concurrency)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+def bench_http(args, run_id, book_dir):
+    """Flask接口（测试客户端，不经过网络栈）"""
+    from app import app
+    client = app.test_client()
+    theme = book_dir.name
+    image = sorted(book_dir.glob("page_*.png"))[0].name
+    paths = {
+        "GET /api/books": "/api/books",
+        "GET /api/books/<theme>": f"/api/books/{theme}",
+        "GET image": f"/api/books/{theme}/images/{image}",
+        "GET image variant": f"/api/books/{theme}/images/{image}?w=640&fmt=webp",
+        "GET pdf": f"/api/books/{theme}/pdf",
+    }
+    results = []
+    for name, path in paths.items():
+        request = lambda _, path=path: client.get(path).status_code == 200
+        results.append(measure(name, request, range(args.iterations), args.concurrency))
+    return results
+
+
+def run_scenarios(args, run_id):
+    results = []
+    if "generate" in args.scenarios:
+        results.append(bench_generate(args, run_id))
+    if {"pdf", "overlay", "http"} & set(args.scenarios):
+        book_dir = _sample_book(run_id)
+        if not book_dir:
+            raise SystemExit("无法生成样例绘本，请检查模拟服务配置")
+        book_dir = Path(book_dir)
+        if "pdf" in args.scenarios:
+            results.append(bench_pdf(args, run_id, book_dir))
+        if "overlay" in args.scenarios:
+            results.append(bench_overlay(args, run_id, book_dir))
+        if "http" in args.scenarios:
+            results.extend(bench_http(args, run_id, book_dir))
+    return results
+
+
+def print_table(results):
+    columns = ("scenario", "count", "failures", "throughput", "p50_ms", "p95_ms", "p99_ms", "peak_rss_mb")
+    widths = [max(len(c), *(len(str(r[c])) for r in results)) for c in columns]
+    print("  ".join(c.ljust(w) for c, w in zip(columns, widths)))
+    for result in results:
+        print("  ".join(str(result[c]).ljust(w) for c, w in zip(columns, widths)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="绘本生成端到端性能基准")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--books", type=int, default=4, help="generate 场景生成的绘本数")
+    parser.add_argument("--pages", type=int, default=4, help="每本绘本页数")
+    parser.add_argument("--concurrency", type=int, default=2, help="同时执行的请求数")
+    parser.add_argument("--iterations", type=int, default=20, help="pdf/overlay/http 场景的执行次数")
+    parser.add_argument("--stream", action="store_true", help="流式生成故事")
+    parser.add_argument("--text-latency", type=float, default=0.5, help="模拟对话补全延迟（秒）")
+    parser.add_argument("--image-latency", type=float, default=1.0, help="模拟图片生成延迟（秒）")
+    parser.add_argument("--jitter", type=float, default=0.2, help="延迟抖动比例")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="模拟服务返回500的比例")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="模拟服务返回429的比例")
+    parser.add_argument("--image-mode", choices=["base64", "url"], default="base64")
+    parser.add_argument("--workdir", help="工作目录（默认临时目录，结束后删除）")
+    parser.add_argument("--output", help="JSON报告路径")
+    args = parser.parse_args(argv)
+
+    config = FakeConfig(text_latency=args.text_latency, image_latency=args.image_latency, jitter=args.jitter,
+                        error_rate=args.error_rate, throttle_rate=args.throttle_rate, image_mode=args.image_mode)
+    server, base_url = start(config)
+
+    # 必须在导入 main/app 之前设置：接口地址与凭据在模块加载时读取
+    os.environ.update({
+        "ARK_BASE_URL": f"{base_url}/api/v3",
+        "VOLC_ENDPOINT": base_url,
+        "ARK_API_KEY": "bench",
+        "VOLC_AK": "bench",
+        "VOLC_SK": "bench",
+    })
+    output = Path(args.output).resolve() if args.output else None
+    workdir = Path(args.workdir or tempfile.mkdtemp(prefix="storybook-bench-")).resolve()
+    workdir.mkdir(parents=True, exist_ok=True)
+    os.chdir(workdir)  # books/ 与 .cache/ 均为相对路径
+
+    # 模块导入时会把根日志级别设为DEBUG，压测输出只保留警告
+    import main as _main  # noqa: F401
+    logging.getLogger().setLevel(logging.WARNING)
+
+    run_id = f"{int(time.time())}"
+    try:
+        # generate_book 会向标准输出打印分页内容，压测期间丢弃（各线程共享 sys.stdout，只能整体重定向）
+        with contextlib.redirect_stdout(io.StringIO()):
+            results = run_scenarios(args, run_id)
+    finally:
+        server.shutdown()
+        from utils.cpu_pool import shutdown
+        shutdown()
+        if not args.workdir:
+            os.chdir(REPO_ROOT)
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "started_at": run_id,
+        "args": vars(args),
+        "fake_services": server.config.counters,
+        "results": results,
+    }
+    print_table(results)
+    print(f"模拟服务请求数：{server.config.counters}")
+    if output:
+        output.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+        print(f"报告已写入：{output}")
+    return 0 if not any(result["failures"] for result in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
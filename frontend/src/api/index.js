@@ -10,30 +10,119 @@ export function generateBook(params) {
 }
 
 /**
- * 获取所有绘本列表
+ * 查询生成任务状态
+ * @param {string} jobId 任务ID
  * @returns {Promise}
  */
-export function getBooksList() {
-  return axios.get('/api/books')
+export function getJob(jobId) {
+  return axios.get(`/api/jobs/${encodeURIComponent(jobId)}`)
+}
+
+/**
+ * 轮询等待生成任务结束
+ * @param {string} jobId 任务ID
+ * @param {Function} onProgress 进度回调，参数为任务快照
+ * @param {number} interval 轮询间隔（毫秒）
+ * @returns {Promise} 任务最终快照
+ */
+export async function waitForJob(jobId, onProgress, interval = 2000) {
+  while (true) {
+    const response = await getJob(jobId)
+    const job = response.data.job
+    if (onProgress) {
+      onProgress(job)
+    }
+    if (job.status === 'succeeded' || job.status === 'failed') {
+      return job
+    }
+    await new Promise(resolve => setTimeout(resolve, interval))
+  }
+}
+
+/**
+ * 订阅生成任务的事件流（SSE），不支持 EventSource 或连接失败时退回轮询
+ * 事件类型：status、story_ready、page（每页状态，完成时带图片 url）、book_ready（带 pdf_url）、done
+ * @param {string} jobId 任务ID
+ * @param {Function} onEvent 事件回调，参数为 (事件类型, 数据)
+ * @returns {Promise} 任务最终快照
+ */
+export function watchJob(jobId, onEvent) {
+  if (typeof EventSource === 'undefined') {
+    return waitForJob(jobId)
+  }
+  return new Promise((resolve, reject) => {
+    const source = new EventSource(`/api/jobs/${encodeURIComponent(jobId)}/events`)
+    const types = ['status', 'story_ready', 'page', 'book_ready', 'done']
+    types.forEach(type => {
+      source.addEventListener(type, event => {
+        const data = JSON.parse(event.data)
+        if (onEvent) {
+          onEvent(type, data)
+        }
+        if (type === 'done') {
+          source.close()
+          getJob(jobId).then(response => resolve(response.data.job), reject)
+        }
+      })
+    })
+    source.onerror = () => {
+      // 浏览器会自动重连（携带 Last-Event-ID）；连接被拒绝时改为轮询
+      if (source.readyState === EventSource.CLOSED) {
+        waitForJob(jobId).then(resolve, reject)
+      }
+    }
+  })
+}
+
+/**
+ * 分页获取绘本列表
+ * @param {Object} params 查询参数（page、page_size、sort、order、theme、style）
+ * @returns {Promise}
+ */
+export function getBooksList(params = {}) {
+  return axios.get('/api/books', { params })
+}
+
+/**
+ * 获取单本绘本的完整元数据与图片列表
+ * @param {string} theme 绘本主题
+ * @returns {Promise}
+ */
+export function getBook(theme) {
+  return axios.get(`/api/books/${encodeURIComponent(theme)}`)
 }
 
 /**
  * 获取图片URL
  * @param {string} theme 绘本主题
  * @param {string} filename 图片文件名
+ * @param {Object} options 可选，{ width, format, version }，指定宽度时返回缩放后的派生图；
+ *   version（绘本的 updated_at）用于缓存失效，带版本的URL可被浏览器长期缓存
  * @returns {string} 图片URL
  */
-export function getImageUrl(theme, filename) {
-  return `/api/books/${encodeURIComponent(theme)}/images/${encodeURIComponent(filename)}`
+export function getImageUrl(theme, filename, options = {}) {
+  const url = `/api/books/${encodeURIComponent(theme)}/images/${encodeURIComponent(filename)}`
+  const query = new URLSearchParams()
+  if (options.width) {
+    query.set('w', options.width)
+    query.set('fmt', options.format || 'auto')
+  }
+  if (options.version) {
+    query.set('v', options.version)
+  }
+  const search = query.toString()
+  return search ? `${url}?${search}` : url
 }
 
 /**
  * 获取PDF下载链接
  * @param {string} theme 绘本主题
+ * @param {number} version 可选，绘本的 updated_at，用于缓存失效
  * @returns {string} PDF链接
  */
-export function getPdfUrl(theme) {
-  return `/api/books/${encodeURIComponent(theme)}/pdf`
+export function getPdfUrl(theme, version) {
+  const url = `/api/books/${encodeURIComponent(theme)}/pdf`
+  return version ? `${url}?v=${version}` : url
 }
 
 /**
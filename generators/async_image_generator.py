@@ -0,0 +1,141 @@
+# generators/async_image_generator.py
+import asyncio
+import base64
+import json
+import logging
+import os
+import httpx
+from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
+
+from generators.image_generator import VolcBookGenerator, SERVICE_CONFIG
+from utils.image_cache import request_key
+from utils.rate_limit import THROTTLE_CODES, RateLimited, async_api_slot, throttled, wait_rate_limited
+from utils.metrics import record_retry, span, traced
+
+logger = logging.getLogger(__name__)
+
+# 异步客户端连接池配置
+ASYNC_POOL_CONFIG = {
+    "max_connections": int(os.getenv("VOLC_ASYNC_MAX_CONNECTIONS", 64)),
+    "max_keepalive_connections": int(os.getenv("VOLC_ASYNC_MAX_KEEPALIVE", 32)),
+}
+
+
+class AsyncVolcBookGenerator(VolcBookGenerator):
+    """火山引擎绘本生成器（asyncio版本，复用同步版的签名与文字叠加逻辑）"""
+
+    def __init__(self, output_dir="output", client=None):
+        super().__init__(output_dir=output_dir)
+        self._client = client
+        self._owns_client = client is None
+
+    @property
+    def client(self):
+        """按需创建异步HTTP客户端（需在事件循环内使用）"""
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(40, connect=20),
+                limits=httpx.Limits(**ASYNC_POOL_CONFIG),
+            )
+        return self._client
+
+    async def aclose(self):
+        """关闭自建的HTTP客户端"""
+        if self._owns_client and self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    # 与同步版 generate_page 一致：只重试限流，其他HTTP错误（如4xx参数错误）直接失败
+    @retry(stop=stop_after_attempt(3), wait=wait_rate_limited(wait_exponential(multiplier=1, min=10, max=30)),
+           retry=retry_if_exception_type(RateLimited), before_sleep=record_retry)
+    async def _request_image(self, request_body):
+        """发送生成请求（重试期间使用 asyncio.sleep，不阻塞事件循环；限流时按 Retry-After 等待）"""
+        body = json.dumps(request_body)
+        async with async_api_slot("image"):
+            response = await self.client.post(
+                SERVICE_CONFIG["endpoint"],
+                params={
+                    "Action": SERVICE_CONFIG["action"],
+                    "Version": SERVICE_CONFIG["version"]
+                },
+                headers=self._generate_headers(body),
+                content=body,
+            )
+            response.raise_for_status()
+        result = response.json()
+        if isinstance(result, dict) and result.get("code") in THROTTLE_CODES:
+            raise throttled("image")
+        return result
+
+    @traced("generate_page")
+    async def generate_page(self, prompt: str, page_num: int = None, use_cache=True, **params):
+        """生成绘本页面（相同请求体命中图片缓存时不调用接口）"""
+        try:
+            # 构造请求体
+            request_body = {
+                "req_key": "high_aes_general_v21_L",
+                "prompt": prompt,
+                "width": 1024,
+                "height": 768,
+                **params
+            }
+
+            page_num = self._next_page_num(page_num)
+            cached = await asyncio.to_thread(self._cached_page, request_body, page_num, use_cache)
+            if cached:
+                return cached
+
+            result = await self._request_image(request_body)
+
+            logger.debug(f"API原始响应：{json.dumps(result, ensure_ascii=False)}")
+            if not isinstance(result, dict) or result.get("code") != 10000:
+                logger.error(f"生成失败：{result.get('message', '未知错误')}")
+                return None
+
+            data = result.get("data", {})
+            binary_data = data.get("binary_data_base64", [])
+            image_urls = data.get("image_urls", [])
+
+            text_info = params.get('text_info')
+
+            # 优先处理base64数据
+            if binary_data:
+                with span("decode_image"):
+                    image_content = base64.b64decode(binary_data[0])
+                save_path = await asyncio.to_thread(self._write_page, image_content, page_num, text_info,
+                                                    request_key(request_body))
+                logger.info(f"Base64图片保存成功：{save_path}")
+                return save_path
+            elif image_urls:
+                return await self._save_image(image_urls[0], page_num, text_info,
+                                              cache_key=request_key(request_body))
+            else:
+                logger.error("响应中未包含有效图片数据")
+                return None
+
+        except Exception as e:
+            logger.error(f"生成过程中出现错误：{str(e)}")
+            return None
+
+    @traced("save_image")
+    @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=10, max=30), before_sleep=record_retry)
+    async def _save_image(self, image_url: str, page_num: int, text_info=None, cache_key=None):
+        """下载并保存图片"""
+        try:
+            response = await self.client.get(image_url, timeout=15)
+            response.raise_for_status()
+
+            save_path = await asyncio.to_thread(self._write_page, response.content, page_num, text_info,
+                                                cache_key)
+
+            logger.info(f"页面保存成功：{save_path}")
+            return save_path
+        except Exception as e:
+            logger.error(f"图片处理失败：{str(e)}")
+            raise
@@ -1,16 +1,26 @@
 import base64
+import io
 import json
 import os
 import hashlib
 import hmac
 import logging
+import threading
 import requests
+from requests.adapters import HTTPAdapter
 from datetime import datetime
 from pathlib import Path
 from tenacity import retry, stop_after_attempt, wait_exponential
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image, ImageDraw
 from dotenv import load_dotenv
 
+from utils.image_cache import ImageCache, get_image_cache, request_key
+from utils.fonts import get_font, resolve_font_path, verify_font
+from utils.text_wrap import measure, wrap_text
+from utils.cpu_pool import run_cpu
+from utils.rate_limit import THROTTLE_CODES, RateLimited, api_slot, give_up, throttled, wait_rate_limited
+from utils.metrics import record_retry, span, traced
+
 logging.basicConfig(level=logging.DEBUG)  # 显示详细调试信息
 # 配置日志
 # logging.basicConfig(level=logging.INFO,
@@ -23,44 +33,140 @@ SERVICE_CONFIG = {
     "service": "cv",
     "region": "cn-north-1",
     "host": "visual.volcengineapi.com",
-    "endpoint": "https://visual.volcengineapi.com",
+    # 请求地址可指向本地模拟服务（见 benchmarks/），签名仍使用 host
+    "endpoint": os.getenv("VOLC_ENDPOINT", "https://visual.volcengineapi.com"),
     "action": "CVProcess",
     "version": "2022-08-31"
 }
 
+# PNG编码配置（压缩级别0-9，optimize会显著增加编码耗时）
+PNG_ENCODE_CONFIG = {
+    "compress_level": int(os.getenv("PNG_COMPRESS_LEVEL", 6)),
+    "optimize": os.getenv("PNG_OPTIMIZE", "false").lower() in ("1", "true", "yes"),
+}
+
+# 叠加文字字号
+OVERLAY_FONT_SIZE = int(os.getenv("OVERLAY_FONT_SIZE", 36))
+# 叠加文字描边宽度
+OVERLAY_STROKE_WIDTH = int(os.getenv("OVERLAY_STROKE_WIDTH", 2))
+
+# 连接池配置（进程内所有生成器共享）
+HTTP_POOL_CONFIG = {
+    "pool_connections": int(os.getenv("VOLC_POOL_CONNECTIONS", 4)),
+    "pool_maxsize": int(os.getenv("VOLC_POOL_MAXSIZE", 32)),
+}
+
+_http_session = None
+_http_session_lock = threading.Lock()
+
+
+def get_http_session():
+    """获取进程内共享的HTTP会话（长连接复用，避免每页重复TCP+TLS握手）"""
+    global _http_session
+    if _http_session is None:
+        with _http_session_lock:
+            if _http_session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_connections=HTTP_POOL_CONFIG["pool_connections"],
+                    pool_maxsize=HTTP_POOL_CONFIG["pool_maxsize"],
+                )
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _http_session = session
+    return _http_session
+
+
+def encode_png(image):
+    """按配置编码PNG，返回字节"""
+    buffer = io.BytesIO()
+    image.save(buffer, "PNG", compress_level=PNG_ENCODE_CONFIG["compress_level"],
+               optimize=PNG_ENCODE_CONFIG["optimize"])
+    return buffer.getvalue()
+
+
+def atomic_write(path, data: bytes):
+    """先写临时文件再原子替换，读取方不会看到写了一半的图片"""
+    path = Path(path)
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+    return path
+
+
+def draw_text_overlay(image, text_info, font_path=None):
+    """在内存中的图片上绘制文字（原地修改并返回图片）"""
+    # 字体配置（复用进程内已加载的字体对象）
+    font = get_font(font_path, OVERLAY_FONT_SIZE)
+    if font is None:
+        logger.warning("没有可用的中文字体，跳过文字叠加")
+        return image
+    draw = ImageDraw.Draw(image)
+    text = text_info.get("text", "")
+    color = text_info.get("color", "#FFFFFF")
+
+    # 换行：字形宽度按字体缓存，中文按字符断行，单次线性扫描
+    margin = 50
+    line_spacing = 10
+    lines = wrap_text(text, font, image.width - 2 * margin)
+
+    # 计算垂直位置（底部居中），行高取字体的上下伸部之和
+    ascent, descent = font.getmetrics()
+    line_height = ascent + descent
+    total_height = line_height * len(lines) + line_spacing * (len(lines) - 1)
+    y_start = image.height - total_height - margin
+    x_center = image.width // 2
+
+    # 绘制文字（描边代替四次偏移绘制阴影）
+    for line in lines:
+        x = x_center - int(measure(line, font)) // 2  # 水平居中
+        draw.text(
+            (x, y_start),
+            line,
+            font=font,
+            fill=color,
+            stroke_width=OVERLAY_STROKE_WIDTH,
+            stroke_fill="black"
+        )
+        y_start += line_height + line_spacing  # 行间距
+    return image
+
+
+def render_overlay(image_bytes: bytes, text_info, font_path=None):
+    """解码、叠加文字、单次编码，全程在内存中完成，返回PNG字节"""
+    with Image.open(io.BytesIO(image_bytes)) as image:
+        image.load()
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGB")
+        draw_text_overlay(image, text_info, font_path)
+        return encode_png(image)
+
+
 class VolcBookGenerator:
     """火山引擎绘本生成器"""
 
     # 添加load_dotenv()  默认加载.env文件
     load_dotenv()
 
-    def __init__(self, output_dir="output"):
+    def __init__(self, output_dir="output", session=None):
         # 初始化配置
+        self.session = session or get_http_session()
         self.access_key = os.getenv("VOLC_AK")
         self.secret_key = os.getenv("VOLC_SK")
         self.output_dir = Path(output_dir)
         self._validate_credentials()
         self._init_workspace()
-        self.font_path = "/System/Library/Fonts/Supplemental/Songti.ttc"
-        self.verify_font()
+        self.font_path = resolve_font_path("overlay")
+        if not self.verify_font():
+            # 没有可用的中文字体时不叠加文字（Pillow默认字体不含中文字形，只会画出方框）
+            self.font_path = None
         # 页面计数器
         self.page_count = 0
+
     def verify_font(self):
-        """验证字体可用性"""
-        try:
-            # 验证字体文件是否存在
-            if not os.path.exists(self.font_path):
-                raise FileNotFoundError(f"未找到字体文件：{self.font_path}")
-
-            # 验证中文字体支持
-            test_font = ImageFont.truetype(self.font_path, 36, index=0)
-            test_image = Image.new('RGB', (100, 50), color=(255, 255, 255))
-            draw = ImageDraw.Draw(test_image)
-            draw.text((10, 10), "测试", font=test_font, fill="black")
-            logger.info("字体验证成功")
-        except Exception as e:
-            logger.error(f"字体验证失败：{str(e)}")
-            raise
+        """验证字体可用性与中文支持（进程内每个字体只验证一次，失败时不叠加文字）"""
+        return verify_font(self.font_path)
 
     def _validate_credentials(self):
         """验证凭证有效性"""
@@ -85,6 +191,7 @@ class VolcBookGenerator:
         k_service = self.sign(k_region, SERVICE_CONFIG["service"])
         return self.sign(k_service, 'request')
 
+    @traced("sign_request")
     def _generate_headers(self, body: str):
         """生成请求头（包含签名）"""
         t = datetime.utcnow()
@@ -127,9 +234,63 @@ class VolcBookGenerator:
             'Content-Type': 'application/json'
         }
 
-    @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=10, max=30))
-    def generate_page(self, prompt: str, page_num: int = None, **params):
-        """生成绘本页面"""
+    def _next_page_num(self, page_num):
+        """未指定页码时自动递增"""
+        if page_num is None:
+            self.page_count += 1
+            page_num = self.page_count
+        return page_num
+
+    def _cached_page(self, request_body, page_num, use_cache=True):
+        """命中图片缓存时直接落盘并返回路径，否则返回None"""
+        cache = get_image_cache() if use_cache else None
+        if cache is None:
+            return None
+        cached_path = cache.get(request_key(request_body))
+        if cached_path is None:
+            return None
+        logger.info(f"图片缓存命中：第{page_num}页")
+        return self._write_page(None, page_num, request_body.get("text_info"), cached_path=cached_path)
+
+    def _write_page(self, image_content, page_num, text_info=None, cache_key=None, cached_path=None):
+        """保存页面图片，启用图片缓存时原始图片先写入缓存
+
+        需要叠加文字时在内存中完成解码、绘制与单次编码，最后一次性原子写入
+        """
+        save_path = self.output_dir / f"page_{page_num:03d}.png"
+        cache = get_image_cache()
+        if cached_path is None and cache is not None and cache_key:
+            cached_path = cache.put(cache_key, image_content)
+
+        if text_info and not self.font_path:
+            logger.warning(f"没有可用的中文字体，跳过文字叠加，保留原图：{save_path}")
+            text_info = None
+        if not text_info:
+            if cached_path is not None:
+                # 无需叠加文字时直接复制缓存文件
+                ImageCache.materialize(cached_path, save_path)
+            else:
+                atomic_write(save_path, image_content)
+            return save_path
+
+        if image_content is None:
+            with open(cached_path, "rb") as f:
+                image_content = f.read()
+        try:
+            with span("add_text_overlay"):
+                image_content = run_cpu(render_overlay, image_content, text_info, self.font_path)
+            logger.info(f"文字叠加成功：{text_info.get('text', '')} -> {save_path}")
+        except Exception as e:
+            # 叠加失败时保留原图
+            logger.error(f"文字叠加失败：{str(e)}")
+        atomic_write(save_path, image_content)
+        return save_path
+
+    @traced("generate_page")
+    @retry(stop=stop_after_attempt(3), wait=wait_rate_limited(wait_exponential(multiplier=1, min=10, max=30)),
+           retry_error_callback=give_up, before_sleep=record_retry)
+    def generate_page(self, prompt: str, page_num: int = None, use_cache=True, **params):
+        """生成绘本页面（相同请求体命中图片缓存时不调用接口）"""
         try:
             # 构造请求体
             request_body = {
@@ -140,24 +301,32 @@ class VolcBookGenerator:
                 **params
             }
 
-            # 发送生成请求
-            response = requests.post(
-                SERVICE_CONFIG["endpoint"],
-                params={
-                    "Action": SERVICE_CONFIG["action"],
-                    "Version": SERVICE_CONFIG["version"]
-                },
-                headers=self._generate_headers(json.dumps(request_body)),
-                json=request_body,
-                timeout=(20, 40)  # 连接超时10秒，读取超时30秒
-            )
-            response.raise_for_status()
+            page_num = self._next_page_num(page_num)
+            cached = self._cached_page(request_body, page_num, use_cache)
+            if cached:
+                return cached
+
+            # 发送生成请求（受全局并发名额与速率限制，HTTP 429 转换为 RateLimited）
+            with api_slot("image"):
+                response = self.session.post(
+                    SERVICE_CONFIG["endpoint"],
+                    params={
+                        "Action": SERVICE_CONFIG["action"],
+                        "Version": SERVICE_CONFIG["version"]
+                    },
+                    headers=self._generate_headers(json.dumps(request_body)),
+                    json=request_body,
+                    timeout=(20, 40)  # 连接超时10秒，读取超时30秒
+                )
+                response.raise_for_status()
 
             # 处理响应数据
             result = response.json()
 
             # 调试日志：打印原始响应
             logger.debug(f"API原始响应：{json.dumps(result, ensure_ascii=False)}")
+            if isinstance(result, dict) and result.get("code") in THROTTLE_CODES:
+                raise throttled("image")
             # 修改状态码判断条件
             if not isinstance(result, dict) or result.get("code") != 10000:
                 logger.error(f"生成失败：{result.get('message', '未知错误')}")
@@ -168,121 +337,44 @@ class VolcBookGenerator:
             image_urls = data.get("image_urls", [])
 
             # 优先处理base64数据
+            text_info = params.get('text_info')
             if binary_data:
-                image_content = base64.b64decode(binary_data[0])
-                if page_num is None:
-                    self.page_count += 1
-                    page_num = self.page_count
-                filename = f"page_{page_num:03d}.png"
-                save_path = self.output_dir / filename
-                with open(save_path, "wb") as f:
-                    f.write(image_content)
+                with span("decode_image"):
+                    image_content = base64.b64decode(binary_data[0])
+                save_path = self._write_page(image_content, page_num, text_info,
+                                             cache_key=request_key(request_body))
                 logger.info(f"Base64图片保存成功：{save_path}")
-                # 添加文字叠加逻辑
-                text_info = params.get('text_info')
-                if text_info:
-                    self.add_text_overlay(save_path, text_info)
                 return save_path
             elif image_urls:
-                image_url = image_urls[0]
-                if page_num is None:
-                    self.page_count += 1
-                    page_num = self.page_count
-                return self._save_image(image_url, page_num)
+                return self._save_image(image_urls[0], page_num, text_info,
+                                        cache_key=request_key(request_body))
             else:
                 logger.error("响应中未包含有效图片数据")
                 return None
 
+        except RateLimited:
+            # 限流交给重试装饰器，按 Retry-After 等待后重试
+            raise
         except Exception as e:
             logger.error(f"生成过程中出现错误：{str(e)}")
             return None
 
+    @traced("add_text_overlay")
     def add_text_overlay(self, image_path, text_info):
-        """在图片上叠加文字 """
+        """在图片文件上叠加文字（读取、绘制、单次编码后原子替换原文件）"""
         if not text_info:
             return image_path
+        if not self.font_path:
+            logger.warning(f"没有可用的中文字体，跳过文字叠加，保留原图：{image_path}")
+            return image_path
 
         try:
             if not os.path.exists(image_path):
                 raise FileNotFoundError(f"图片文件未找到：{image_path}")
 
-            image = Image.open(image_path)
-            draw = ImageDraw.Draw(image)
-
-            # 字体配置
-            FONT_PATH = "/Library/Fonts/SourceHanSerifSC-Regular.otf"
-            if not os.path.exists(FONT_PATH):
-                raise FileNotFoundError(f"思源字体未找到：{FONT_PATH}")
-
-            font = ImageFont.truetype(FONT_PATH, 36)
-            text = text_info.get("text", "")
-            color = text_info.get("color", "#FFFFFF")
-            # 自动换行和位置计算
-            # margin = 50
-            # max_width = image.width - 2 * margin
-            # lines = []
-            # line = ""
-            # for word in text:
-            #     test_line = line + word
-            #     bbox = draw.textbbox((0, 0), test_line, font=font)
-            #     if bbox[2] - bbox[0] > max_width:
-            #         lines.append(line)
-            #         line = word
-            #     else:
-            #         line += word
-            # lines.append(line)
-
-            # 3. 智能换行算法
-            margin = 50
-            max_width = image.width - 2 * margin
-            lines = []
-            current_line = ""
-
-            for word in text.split(" "):
-                test_line = current_line + word + " "
-                bbox = draw.textbbox((0, 0), test_line, font=font)
-                text_width = bbox[2] - bbox[0]
-
-                if text_width <= max_width:
-                    current_line = test_line
-                else:
-                    lines.append(current_line.strip())
-                    current_line = word + " "
-            lines.append(current_line.strip())
-
-            # 计算垂直位置（底部居中）
-            total_height = sum(
-                draw.textbbox((0, 0), line, font=font)[3]
-                for line in lines
-            ) + 10 * (len(lines) - 1)
-            y_start = image.height - total_height - margin
-            x_center = image.width // 2
-
-            # 绘制文字
-            for line in lines:
-                bbox = draw.textbbox((0, 0), line, font=font)
-                # x = (image.width - (bbox[2] - bbox[0])) // 2  # 水平居中
-                line_width = bbox[2] - bbox[0]
-                x = x_center - line_width // 2  # 水平居中
-                # 绘制阴影
-                for offset in [(-1,-1), (-1,1), (1,-1), (1,1)]:
-                    draw.text(
-                        (x + offset[0], y_start + offset[1]),
-                        line,
-                        font=font,
-                        fill="black"
-                    )
-
-                draw.text(
-                    (x, y_start),
-                    line,
-                    font=font,
-                    fill=color
-                )
-                y_start += bbox[3] + 10  # 行间距
-            # 6. 保存图片
-            image.save(image_path)
-            logger.info(f"文字叠加成功：{text} -> {image_path}")
+            with open(image_path, "rb") as f:
+                atomic_write(image_path, run_cpu(render_overlay, f.read(), text_info, self.font_path))
+            logger.info(f"文字叠加成功：{text_info.get('text', '')} -> {image_path}")
             return image_path
 
         except Exception as e:
@@ -373,25 +465,18 @@ class VolcBookGenerator:
         # except Exception as e:
         #     logger.error(f"文字叠加失败：{str(e)}")
         #     raise
-    @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=10, max=30))
-    def _save_image(self, image_url: str, page_num: int, text_info=None):
+    @traced("save_image")
+    @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=10, max=30), before_sleep=record_retry)
+    def _save_image(self, image_url: str, page_num: int, text_info=None, cache_key=None):
         """下载并保存图片"""
         try:
 
-            response = requests.get(image_url, timeout=15)
+            response = self.session.get(image_url, timeout=15)
             response.raise_for_status()
 
-            filename = f"page_{page_num:03d}.png"
-            save_path = self.output_dir / filename
-
-            with open(save_path, "wb") as f:
-                f.write(response.content)
+            save_path = self._write_page(response.content, page_num, text_info, cache_key=cache_key)
 
             logger.info(f"页面保存成功：{save_path}")
-            # 新增文字叠加逻辑
-            if text_info:
-                self.add_text_overlay(save_path, text_info)
-
             return save_path
         except Exception as e:
             logger.error(f"图片处理失败：{str(e)}")
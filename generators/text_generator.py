@@ -6,6 +6,10 @@ from openai import OpenAI
 from dotenv import load_dotenv
 from tenacity import retry, stop_after_attempt, wait_exponential
 
+from utils.story_cache import get_story_cache, make_key
+from utils.rate_limit import RateLimited, api_slot, concurrency_slot, give_up, rate_limited, wait_rate_limited
+from utils.metrics import record_retry, traced
+
 # 加载环境变量
 load_dotenv()
 
@@ -13,13 +17,110 @@ load_dotenv()
 logger = logging.getLogger(__name__)
 
 # 初始化火山引擎客户端
+# ARK_BASE_URL 可指向本地模拟服务（见 benchmarks/）
+# 关闭SDK内置重试：HTTP 429 须经 rate_limited 转换为 RateLimited，由令牌桶降速并按 Retry-After 重试
 client = OpenAI(
-    base_url="https://ark.cn-beijing.volces.com/api/v3",
+    base_url=os.getenv("ARK_BASE_URL", "https://ark.cn-beijing.volces.com/api/v3"),
     api_key=os.environ.get("ARK_API_KEY"),
+    max_retries=0,
 )
 
-@retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=2, max=10))
-def generate_story(params):
+# 模型接入点与采样参数
+MODEL_ID = os.getenv("ARK_MODEL_ID", "ep-20250306152138-g824j")  # 替换为实际接入点ID
+SAMPLING_PARAMS = {
+    "temperature": 0.7,
+    "top_p": 0.9,
+    "max_tokens": 1200
+}
+
+PAGE_MARKER = "【PAGE】"
+# 模型输出页数不足时补齐的占位文本
+PLACEHOLDER_PAGE = "（本页内容待补充）"
+
+
+def build_prompts(params, tags_first=False):
+    """构建系统提示词与用户提示词
+
+    tags_first 为 True 时要求先输出可视化标签JSON，便于流式生成时尽早构建图片提示词
+    """
+    # 构建系统提示词
+    system_prompt = """你是一位专业的儿童文学作家，擅长创作适合绘本的短篇故事。请严格按照以下要求创作："""
+
+    if tags_first:
+        tags_rule = """4. 在第一个【PAGE】之前先单独输出一行JSON格式的可视化标签：
+        {"colors": ["主色1", "主色2"], "objects": ["关键物体1", "关键物体2"]}"""
+    else:
+        tags_rule = """4. 最后追加JSON格式的可视化标签：
+        {"colors": ["主色1", "主色2"], "objects": ["关键物体1", "关键物体2"]}"""
+
+    # 构建用户提示词
+    user_prompt = f"""
+        创作主题：{params['theme']}
+        风格要求：{params['style']}风格
+        字数限制：{params['page_count']*80}-{params['page_count']*120}字
+        格式要求：
+        1. 明确分为{params['page_count']}个段落，每段以【PAGE】标记开头
+        2. 每段包含3-5个可视化元素（用[]标记，如[彩虹滑梯]）
+        3. 包含简单对话（用「」标记）
+        {tags_rule}
+        """
+    return system_prompt, user_prompt
+
+
+def _extract_visual_tags(text):
+    """从文本中提取最后一个JSON对象，返回 (visual_tags, 去除JSON后的文本)"""
+    if "{" in text and "}" in text:
+        try:
+            json_start = text.rfind("{")
+            json_end = text.rfind("}") + 1
+            return json.loads(text[json_start:json_end]), (text[:json_start] + text[json_end:]).strip()
+        except json.JSONDecodeError:
+            pass
+    return None, text
+
+
+def parse_story(raw_text, params):
+    """解析模型输出，返回分页内容与可视化标签"""
+    # 提取可视化标签
+    visual_tags, story_content = _extract_visual_tags(raw_text)
+
+    # 分页处理
+    pages = []
+    current_page = []
+    for line in story_content.split("\n"):
+        if line.startswith(PAGE_MARKER):
+            if current_page:
+                pages.append(" ".join(current_page))
+                current_page = []
+            current_page.append(line.replace(PAGE_MARKER, "").strip())
+        else:
+            current_page.append(line.strip())
+    if current_page:
+        pages.append(" ".join(current_page))
+
+    # 确保页数匹配
+    pages = pages[:params["page_count"]]
+    while len(pages) < params["page_count"]:
+        pages.append(PLACEHOLDER_PAGE)
+
+    return pages, visual_tags or {"colors": [], "objects": []}
+
+
+def _cacheable(finish_reason, pages):
+    """只缓存完整的故事：模型正常结束（未因长度截断）且没有补齐的占位页，否则相同参数的请求会反复拿到残缺故事"""
+    return finish_reason == "stop" and PLACEHOLDER_PAGE not in pages
+
+
+def story_cache_key(params, stream=False):
+    """故事缓存键：渲染后的提示词 + 模型ID + 采样参数"""
+    system_prompt, user_prompt = build_prompts(params, tags_first=stream)
+    return make_key(system_prompt, user_prompt, MODEL_ID, SAMPLING_PARAMS)
+
+
+@traced("generate_story")
+@retry(stop=stop_after_attempt(3), wait=wait_rate_limited(wait_exponential(multiplier=1, min=2, max=10)),
+       retry_error_callback=give_up, before_sleep=record_retry)
+def generate_story(params, use_cache=True):
     """
     通过火山引擎方舟平台生成儿童故事
     参数格式：
@@ -28,82 +129,181 @@ def generate_story(params):
         "style": "卡通",
         "page_count": 4
     }
+    use_cache 为 False 时跳过故事缓存，强制重新调用模型
     """
     try:
-        # 构建系统提示词
-        system_prompt = """你是一位专业的儿童文学作家，擅长创作适合绘本的短篇故事。请严格按照以下要求创作："""
+        cache_key = story_cache_key(params)
+        if use_cache:
+            cached = get_story_cache().get(cache_key)
+            if cached:
+                logger.info(f"故事缓存命中：{params['theme']}")
+                return cached
 
-        # 构建用户提示词
-        user_prompt = f"""
-        创作主题：{params['theme']}
-        风格要求：{params['style']}风格
-        字数限制：{params['page_count']*80}-{params['page_count']*120}字
-        格式要求：
-        1. 明确分为{params['page_count']}个段落，每段以【PAGE】标记开头
-        2. 每段包含3-5个可视化元素（用[]标记，如[彩虹滑梯]）
-        3. 包含简单对话（用「」标记）
-        4. 最后追加JSON格式的可视化标签：
-        {{"colors": ["主色1", "主色2"], "objects": ["关键物体1", "关键物体2"]}}
-        """
+        system_prompt, user_prompt = build_prompts(params)
 
-        # 调用方舟平台API
-        completion = client.chat.completions.create(
-            model="ep-20250306152138-g824j",  # 替换为实际接入点ID
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
-            temperature=0.7,
-            top_p=0.9,
-            max_tokens=1200
-        )
+        # 调用方舟平台API（受全局并发名额与速率限制）
+        with api_slot("text"):
+            completion = client.chat.completions.create(
+                model=MODEL_ID,
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": user_prompt}
+                ],
+                **SAMPLING_PARAMS
+            )
 
         # 解析响应内容
         raw_text = completion.choices[0].message.content
+        pages, visual_tags = parse_story(raw_text, params)
 
-        # 提取可视化标签
-        if "{" in raw_text and "}" in raw_text:
-            try:
-                json_start = raw_text.rfind("{")
-                json_end = raw_text.rfind("}") + 1
-                visual_tags = json.loads(raw_text[json_start:json_end])
-                story_content = raw_text[:json_start].strip()
-            except json.JSONDecodeError:
-                visual_tags = None
-                story_content = raw_text
-        else:
-            visual_tags = None
-            story_content = raw_text
-
-        # 分页处理
-        pages = []
-        current_page = []
-        for line in story_content.split("\n"):
-            if line.startswith("【PAGE】"):
-                if current_page:
-                    pages.append(" ".join(current_page))
-                    current_page = []
-                current_page.append(line.replace("【PAGE】", "").strip())
-            else:
-                current_page.append(line.strip())
-        if current_page:
-            pages.append(" ".join(current_page))
-
-        # 确保页数匹配
-        pages = pages[:params["page_count"]]
-        while len(pages) < params["page_count"]:
-            pages.append("（本页内容待补充）")
-
-        return {
+        story = {
             "pages": pages,
-            "visual_tags": visual_tags or {"colors": [], "objects": []},
+            "visual_tags": visual_tags,
             "raw_data": completion.model_dump()  # 保留原始响应数据
         }
+        finish_reason = completion.choices[0].finish_reason
+        if _cacheable(finish_reason, pages):
+            get_story_cache().set(cache_key, story)
+        else:
+            logger.warning(f"故事被截断或页数不足（finish_reason={finish_reason}），不写入缓存：{params['theme']}")
+        return story
 
+    except RateLimited:
+        # 限流交给重试装饰器，按 Retry-After 等待后重试
+        raise
     except Exception as e:
         logger.error(f"故事生成失败: {str(e)}")
         return None
 
+
+@retry(stop=stop_after_attempt(3), wait=wait_rate_limited(wait_exponential(multiplier=1, min=2, max=10)),
+       before_sleep=record_retry)
+def _open_story_stream(messages):
+    """建立流式补全连接（仅重试建连阶段，建连受速率限制）"""
+    with rate_limited("text"):
+        return client.chat.completions.create(
+            model=MODEL_ID,
+            messages=messages,
+            stream=True,
+            **SAMPLING_PARAMS
+        )
+
+
+def _limited_stream(messages):
+    """读取流式响应，整个读取过程占用一个文本接口名额"""
+    with concurrency_slot("text"):
+        yield from _open_story_stream(messages)
+
+
+def _replay_story(story):
+    """将缓存的故事按流式事件顺序重放"""
+    yield {"type": "visual_tags", "visual_tags": story["visual_tags"]}
+    for page_num, page_text in enumerate(_split_raw_pages(story), 1):
+        yield {"type": "page", "page_num": page_num, "text": page_text}
+    yield {"type": "done", "story": story}
+
+
+def _split_raw_pages(story):
+    """按【PAGE】切分原始响应（与流式产出的页面文本一致）"""
+    raw_text = story["raw_data"]["choices"][0]["message"]["content"]
+    pages = [p.strip() for p in raw_text.split(PAGE_MARKER)[1:] if p.strip()]
+    return pages[:len(story["pages"])]
+
+
+def generate_story_stream(params, use_cache=True):
+    """
+    流式生成儿童故事，每个【PAGE】段落结束即产出，无需等待完整响应
+
+    依次产出以下事件：
+    {"type": "visual_tags", "visual_tags": {...}}
+    {"type": "page", "page_num": 1, "text": "..."}
+    {"type": "done", "story": {"pages", "visual_tags", "raw_data"}}
+    出错时记录日志并提前结束，不会产出 done 事件
+    """
+    cache_key = story_cache_key(params, stream=True)
+    if use_cache:
+        cached = get_story_cache().get(cache_key)
+        if cached:
+            logger.info(f"故事缓存命中：{params['theme']}")
+            yield from _replay_story(cached)
+            return
+
+    system_prompt, user_prompt = build_prompts(params, tags_first=True)
+    buffer = ""
+    chunks = []
+    emitted = 0
+    visual_tags = None
+    completion_id = None
+    finish_reason = None
+
+    try:
+        stream = _limited_stream([
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt}
+        ])
+        for chunk in stream:
+            completion_id = completion_id or chunk.id
+            if not chunk.choices:
+                continue
+            finish_reason = chunk.choices[0].finish_reason or finish_reason
+            delta = chunk.choices[0].delta.content
+            if not delta:
+                continue
+            chunks.append(delta)
+            buffer += delta
+
+            # 第一个【PAGE】之前的内容为可视化标签
+            if visual_tags is None and PAGE_MARKER in buffer:
+                head, buffer = buffer.split(PAGE_MARKER, 1)
+                buffer = PAGE_MARKER + buffer
+                visual_tags, _ = _extract_visual_tags(head)
+                visual_tags = visual_tags or {}
+                yield {"type": "visual_tags", "visual_tags": visual_tags}
+
+            # 出现下一个【PAGE】即说明上一页已完整
+            while buffer.count(PAGE_MARKER) >= 2 and emitted < params["page_count"]:
+                _, page_text, buffer = buffer.split(PAGE_MARKER, 2)
+                buffer = PAGE_MARKER + buffer
+                emitted += 1
+                yield {"type": "page", "page_num": emitted, "text": page_text.strip()}
+
+        raw_text = "".join(chunks)
+        # 最后一页：去除可能追加在末尾的JSON标签
+        if PAGE_MARKER in buffer and emitted < params["page_count"]:
+            tail_tags, page_text = _extract_visual_tags(buffer.split(PAGE_MARKER, 1)[1])
+            emitted += 1
+            yield {"type": "page", "page_num": emitted, "text": page_text.strip()}
+            if not visual_tags and tail_tags:
+                visual_tags = tail_tags
+                yield {"type": "visual_tags", "visual_tags": visual_tags}
+
+        pages, parsed_tags = parse_story(raw_text, params)
+        # 构造与非流式接口一致的原始响应结构
+        raw_data = {
+            "id": completion_id,
+            "object": "chat.completion",
+            "model": MODEL_ID,
+            "choices": [{
+                "index": 0,
+                "finish_reason": finish_reason,
+                "message": {"role": "assistant", "content": raw_text}
+            }]
+        }
+        story = {
+            "pages": pages,
+            "visual_tags": visual_tags or parsed_tags,
+            "raw_data": raw_data
+        }
+        if _cacheable(finish_reason, pages):
+            get_story_cache().set(cache_key, story)
+        else:
+            logger.warning(f"故事被截断或页数不足（finish_reason={finish_reason}），不写入缓存：{params['theme']}")
+        yield {"type": "done", "story": story}
+
+    except Exception as e:
+        logger.error(f"流式故事生成失败: {str(e)}")
+        return
+
 # 单元测试
 if __name__ == "__main__":
     # 测试配置
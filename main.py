@@ -1,21 +1,93 @@
 # main.py
 import re
 import json
+import asyncio
+import io
 import logging
 import os
+import time
+import uuid
+import shutil
+import threading
+from contextlib import nullcontext
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, wait
 from fpdf import FPDF, XPos, YPos  # 导入新参数类型
+from PIL import Image
 
-from generators.text_generator import generate_story
+from generators.text_generator import generate_story, generate_story_stream
 from generators.image_generator import VolcBookGenerator
-
-# 添加中文字体配置
-FONT_PATH = "/Library/Fonts/SourceHanSerifSC-Regular.otf"  # 思源宋体路径
+from generators.async_image_generator import AsyncVolcBookGenerator
+from utils.catalog import get_catalog
+from utils.manifest import BookManifest
+from utils.image_variants import pregenerate_variants
+from utils.fonts import resolve_font_path
+from utils.cpu_pool import run_cpu
+from utils.metrics import span, traced
+
+# 单本绘本内同时生成的页数
+PAGE_CONCURRENCY = int(os.getenv("PAGE_CONCURRENCY", 4))
+# 是否流式生成故事并提前开始生成图片
+STREAM_STORY = os.getenv("STREAM_STORY", "false").lower() in ("1", "true", "yes")
+# 是否使用 asyncio 图片客户端（generate_book_async，所有页面在同一事件循环内并发）；流式生成故事时不生效
+ASYNC_IMAGE_CLIENT = os.getenv("ASYNC_IMAGE_CLIENT", "false").lower() in ("1", "true", "yes")
+
+# 绘本根目录；生成过程中写入临时构建目录，完成后整体替换到 books/<theme>
+BOOKS_ROOT = Path("books")
+BUILD_ROOT = BOOKS_ROOT / ".building"
+# 超过该时长（秒）的构建目录视为中断残留，启动时清理
+BUILD_STALE_SECONDS = int(os.getenv("BUILD_STALE_SECONDS", 6 * 3600))
+
+# 本进程内正在使用的构建目录（续跑时跳过）
+_active_builds = set()
+
+# 是否在生成绘本时立即生成PDF（默认在首次下载时按需生成）
+PDF_EAGER = os.getenv("PDF_EAGER", "false").lower() in ("1", "true", "yes")
+
+# 按绘本目录区分的PDF构建锁
+_pdf_locks = {}
+_pdf_locks_guard = threading.Lock()
+
+# PDF图片配置：compact 按目标DPI缩放并压缩为JPEG，original 嵌入原始PNG
+PDF_IMAGE_CONFIG = {
+    "mode": os.getenv("PDF_IMAGE_MODE", "compact"),
+    "dpi": int(os.getenv("PDF_IMAGE_DPI", 150)),
+    "jpeg_quality": int(os.getenv("PDF_JPEG_QUALITY", 85)),
+    "max_width_mm": 190,  # 页面图片的排版宽度
+}
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+def _pdf_image_source(image_path, image_sources):
+    """返回用于嵌入PDF的图片（同一文件只处理一次，fpdf按内容去重后只写入一个XObject）
+
+    compact 模式下按目标DPI缩放并重新压缩为JPEG，original 模式直接嵌入原始PNG
+    """
+    key = str(image_path)
+    if key in image_sources:
+        return image_sources[key]
+    if not os.path.exists(image_path):
+        logger.warning(f"PDF跳过缺失的图片：{image_path}")
+        image_sources[key] = None
+        return None
+
+    if PDF_IMAGE_CONFIG["mode"] != "compact":
+        image_sources[key] = key
+        return key
+
+    # 目标像素宽度 = 最大排版宽度(mm) / 25.4 * DPI
+    max_width = int(PDF_IMAGE_CONFIG["max_width_mm"] / 25.4 * PDF_IMAGE_CONFIG["dpi"])
+    with Image.open(image_path) as image:
+        image = image.convert("RGB")
+        if image.width > max_width:
+            image = image.resize((max_width, max_width * image.height // image.width), Image.LANCZOS)
+        buffer = io.BytesIO()
+        image.save(buffer, "JPEG", quality=PDF_IMAGE_CONFIG["jpeg_quality"], optimize=True)
+    image_sources[key] = buffer
+    return buffer
+
 def create_pdf(book_dir, pages):
     """生成绘本PDF（使用思源宋体显示中文）"""
     pdf = FPDF()
@@ -23,11 +95,13 @@ def create_pdf(book_dir, pages):
     # 强制使用UTF-8编码
     pdf.core_fonts_encoding = 'utf-8'
 
-    # 加载中文字体
+    # 加载中文字体（路径在进程内只解析一次；粗体与常规体为同一字体文件，只注册一次）
     try:
-        pdf.add_font('SourceHan', '', FONT_PATH, uni=True)
-        pdf.add_font('SourceHan', 'B', FONT_PATH, uni=True)  # 加载粗体
-        logger.info("成功加载思源宋体")
+        font_path = resolve_font_path("pdf")
+        if not font_path:
+            raise FileNotFoundError("未找到可用的中文字体，请设置 PDF_FONT_PATH")
+        pdf.add_font('SourceHan', '', font_path)
+        logger.info(f"成功加载中文字体：{font_path}")
     except Exception as e:
         logger.error(f"字体加载失败：{e}")
         return
@@ -44,7 +118,7 @@ def create_pdf(book_dir, pages):
 
     # 添加封面
     pdf.add_page()
-    pdf.set_font('SourceHan', 'B', 28)
+    pdf.set_font('SourceHan', '', 28)
 
     # 计算标题垂直位置，使其居中
     pdf.cell(
@@ -68,17 +142,19 @@ def create_pdf(book_dir, pages):
         align='C'
     )
 
-    # 添加封面图片(使用第一页图片)
-    cover_image = str(book_dir / "page_001.png")
-    if os.path.exists(cover_image):
+    # 添加封面图片(使用第一页图片，与第1页共用同一个图片对象，只嵌入一次)
+    image_sources = {}
+    cover_image = _pdf_image_source(book_dir / "page_001.png", image_sources)
+    if cover_image is not None:
         pdf.image(cover_image, x=30, y=80, w=150)
 
     # 为每页内容创建图文对照布局
     for page_num in range(1, len(pages)+1):
         # 添加图片页
         pdf.add_page()
-        image_path = str(book_dir / f"page_{page_num:03d}.png")
-        pdf.image(image_path, x=10, y=10, w=190)  # 插入图片
+        image = _pdf_image_source(book_dir / f"page_{page_num:03d}.png", image_sources)
+        if image is not None:
+            pdf.image(image, x=10, y=10, w=190)  # 插入图片
 
         # 添加页码
         pdf.set_font('SourceHan', '', 10)
@@ -90,7 +166,7 @@ def create_pdf(book_dir, pages):
 
     # 添加完整故事内容页
     pdf.add_page()
-    pdf.set_font('SourceHan', 'B', 16)
+    pdf.set_font('SourceHan', '', 16)
     pdf.cell(
         200,
         20,
@@ -109,7 +185,7 @@ def create_pdf(book_dir, pages):
 
     for i, page_content in enumerate(pages):
         # 添加页标题
-        pdf.set_font('SourceHan', 'B', 14)
+        pdf.set_font('SourceHan', '', 14)
         page_title = f"第{i+1}页"
         pdf.set_xy(10, y_position)
         pdf.cell(190, 10, page_title, ln=1)
@@ -133,8 +209,10 @@ def create_pdf(book_dir, pages):
             pdf.add_page()
             y_position = 15
 
-    # 保存PDF
-    pdf.output(str(book_dir / "book.pdf"))
+    # 保存PDF（先写临时文件再原子替换，下载方不会读到写了一半的文件）
+    tmp_path = book_dir / f".book.pdf.{os.getpid()}.tmp"
+    pdf.output(str(tmp_path))
+    os.replace(tmp_path, book_dir / "book.pdf")
     logger.info(f"PDF生成成功：{book_dir / 'book.pdf'}")
     return str(book_dir / "book.pdf")
 
@@ -151,6 +229,7 @@ def extract_dialogue(page_text):
     # 在生成图片时添加文字信息
 
 
+@traced("build_image_prompt")
 def build_image_prompt(page_text, visual_tags):
     """根据文本内容和可视化标签构建图片生成提示词"""
     # 提取可视化元素
@@ -166,19 +245,131 @@ def build_image_prompt(page_text, visual_tags):
     # prompt += "，文字：\"示例文字\" 位置：顶部中央，大小：72px，颜色：#8B4513"
     return prompt
 
-def generate_book(params):
-    """生成完整绘本"""
-    # 生成故事文本
-    story = generate_story(params)
-    if not story:
-        logger.error("故事生成失败，终止绘本生成")
-        return
+def build_text_info(page_text):
+    """根据页面对话构建文字叠加配置"""
+    dialogue = extract_dialogue(page_text)
+    return {
+        "text": dialogue,
+        "position": "bottom-center",
+        "color": "#FFFFFF"
+    } if dialogue else None
+
+def _report_page(page_num, result, progress_callback):
+    """记录单页结果并上报进度"""
+    if not result:
+        logger.warning(f"第{page_num}页生成失败，跳过...")
+        if progress_callback:
+            progress_callback(page_num, "failed")
+        return None
+    if progress_callback:
+        # 文字叠加在写入页面文件前完成，done 即表示带文字的图片已就绪
+        progress_callback(page_num, "done", Path(result).name)
+    return result
+
+def plan_page(page_num, page_text, visual_tags):
+    """构建单页的生成计划（提示词与文字叠加配置），记录在清单中供续跑复用"""
+    return {
+        "page_num": page_num,
+        "text": page_text,
+        # 构建图片提示词
+        "prompt": build_image_prompt(page_text, visual_tags),
+        # 提取对话内容
+        "text_info": build_text_info(page_text),
+    }
 
-    # 初始化图片生成器
-    image_gen = VolcBookGenerator(output_dir=f"books/{params['theme']}")
+def render_page(image_gen, plan, progress_callback=None, use_cache=True):
+    """按生成计划生成单页插图，失败时返回None而不抛出异常"""
+    page_num = plan["page_num"]
+    logger.info(f"正在生成第{page_num}页...")
+    if progress_callback:
+        progress_callback(page_num, "running")
 
+    try:
+        # 生成带文字的图片
+        result = image_gen.generate_page(
+            prompt=plan["prompt"],
+            page_num=page_num,
+            use_cache=use_cache,
+            text_info=plan["text_info"]
+        )
+    except Exception as e:
+        logger.error(f"第{page_num}页生成异常：{str(e)}")
+        result = None
+
+    return _report_page(page_num, result, progress_callback)
+
+async def render_page_async(image_gen, plan, progress_callback=None, use_cache=True):
+    """异步按生成计划生成单页插图，失败时返回None而不抛出异常"""
+    page_num = plan["page_num"]
+    logger.info(f"正在生成第{page_num}页...")
+    if progress_callback:
+        progress_callback(page_num, "running")
+
+    try:
+        result = await image_gen.generate_page(
+            prompt=plan["prompt"],
+            page_num=page_num,
+            use_cache=use_cache,
+            text_info=plan["text_info"]
+        )
+    except Exception as e:
+        logger.error(f"第{page_num}页生成异常：{str(e)}")
+        result = None
+
+    return _report_page(page_num, result, progress_callback)
+
+def is_valid_theme(theme):
+    """主题直接用作 books/ 下的目录名：不能含路径分隔符或“..”，不能以“.”开头（隐藏目录留给构建目录与索引）"""
+    return (isinstance(theme, str) and bool(theme) and not theme.startswith(".")
+            and not any(part in theme for part in ("/", "\\", "..", "\0")))
+
+def new_build_dir(theme):
+    """为一次生成分配独立的临时构建目录"""
+    build_dir = BUILD_ROOT / f"{theme}-{uuid.uuid4().hex[:8]}"
+    _active_builds.add(build_dir)
+    return build_dir
+
+def _publish_lock(theme):
+    """同一主题的发布与原地修复互斥（锁由目录索引持有，读取方在目录暂时缺失时等待同一把锁）"""
+    return get_catalog().publish_lock(theme)
+
+def publish_book(build_dir, theme):
+    """将构建完成的目录替换到 books/<theme>（两次rename，旧版本在替换后删除），返回正式目录"""
+    target = BOOKS_ROOT / theme
+    if not is_valid_theme(theme) or target.resolve().parent != BOOKS_ROOT.resolve():
+        # 替换时会移走并删除目标目录，绝不能指向 books/ 之外
+        raise ValueError(f"无效的绘本主题：{theme!r}")
+    with _publish_lock(theme):
+        retired = None
+        if target.exists():
+            retired = build_dir.with_name(f"{build_dir.name}.old")
+            os.replace(target, retired)
+        os.replace(build_dir, target)
+    _active_builds.discard(build_dir)
+    if retired:
+        shutil.rmtree(retired, ignore_errors=True)
+    logger.info(f"绘本已发布：{target}")
+    return target
+
+def discard_build(build_dir):
+    """删除未完成的构建目录"""
+    _active_builds.discard(build_dir)
+    shutil.rmtree(build_dir, ignore_errors=True)
+
+def purge_stale_builds(max_age=BUILD_STALE_SECONDS):
+    """清理中断残留的构建目录"""
+    if not BUILD_ROOT.exists():
+        return
+    now = time.time()
+    for build_dir in BUILD_ROOT.iterdir():
+        if now - build_dir.stat().st_mtime > max_age:
+            logger.info(f"清理残留构建目录：{build_dir}")
+            shutil.rmtree(build_dir, ignore_errors=True)
+
+def prepare_book(params, story, book_dir=None):
+    """创建绘本目录（默认 books/<theme>）、保存元数据并返回 (book_dir, pages)"""
     # 创建目录结构
-    book_dir = Path(f"books/{params['theme']}")
+    book_dir = Path(book_dir or BOOKS_ROOT / params["theme"])
     book_dir.mkdir(parents=True, exist_ok=True)
 
     # 保存元数据
@@ -189,42 +380,304 @@ def generate_book(params):
             "raw_data": story["raw_data"]
         }, f, ensure_ascii=False, indent=2)
 
+    return book_dir, split_pages(story["raw_data"], params["page_count"])
+
+def split_pages(raw_data, page_count):
+    """从原始响应中解析分页内容"""
     # 解析分页内容（核心修改）<button class="citation-flag" data-index="1">
-    raw_content = story["raw_data"]["choices"][0]["message"]["content"]
+    raw_content = raw_data["choices"][0]["message"]["content"]
     pages = [p.strip() for p in raw_content.split("【PAGE】")[1:] if p.strip()]
-    pages = pages[:params["page_count"]]  # 确保页数匹配
-
-    # 生成每页内容
-    for page_num, page_text in enumerate(pages, 1):
-        logger.info(f"正在生成第{page_num}页...")
-
-        # 构建图片提示词
-        prompt = build_image_prompt(page_text, story["visual_tags"])
-
-        # 提取对话内容
-        dialogue = extract_dialogue(page_text)
-        text_info = {
-            "text": dialogue,
-            "position": "bottom-center",
-            "color": "#FFFFFF"
-        } if dialogue else None
+    return pages[:page_count]  # 确保页数匹配
+
+@traced("create_pdf")
+def _build_pdf(book_dir, pages):
+    """在CPU进程池中排版PDF（子进程内无法汇总指标，在调用方计时），失败时返回None"""
+    return run_cpu(create_pdf, book_dir, pages)
+
+def _finalize_book(params, build_dir, pages):
+    """在构建目录内生成派生图（及PDF），发布到正式目录并更新目录索引，返回正式目录"""
+    # 派生图与PDF排版为CPU密集型操作，交给进程池执行
+    run_cpu(pregenerate_variants, build_dir)
+    if PDF_EAGER:
+        _build_pdf(build_dir, pages)
+    book_dir = publish_book(build_dir, params["theme"])
+    get_catalog().upsert(params["theme"])
+    return book_dir
+
+def _pdf_is_fresh(book_dir):
+    """PDF存在且不早于元数据与所有页面图片"""
+    pdf_path = book_dir / "book.pdf"
+    try:
+        inputs = [book_dir / "metadata.json"] + list(book_dir.glob("page_*.png"))
+        newest = max(path.stat().st_mtime for path in inputs if path.exists())
+        return pdf_path.stat().st_mtime >= newest
+    except (FileNotFoundError, ValueError):
+        # PDF尚未生成，或目录正被发布替换
+        return False
+
+def ensure_pdf(book_dir):
+    """按需生成PDF：已有且未过期时直接返回，否则构建；同一绘本的并发请求共享一次构建
+
+    绘本不存在或构建失败时返回None
+    """
+    book_dir = Path(book_dir)
+    if not (book_dir / "metadata.json").exists():
+        return None
+    if _pdf_is_fresh(book_dir):
+        return book_dir / "book.pdf"
+
+    # 已发布的绘本持有发布锁构建：发布或原地修复不会在构建期间替换目录
+    published = book_dir.resolve().parent == BOOKS_ROOT.resolve()
+    with _pdf_locks_guard:
+        lock = _pdf_locks.setdefault(str(book_dir.resolve()), threading.Lock())
+    with _publish_lock(book_dir.name) if published else nullcontext(), lock:
+        # 等锁期间可能已由其他请求构建完成，或绘本已被删除
+        if not (book_dir / "metadata.json").exists():
+            return None
+        if _pdf_is_fresh(book_dir):
+            return book_dir / "book.pdf"
+
+        with open(book_dir / "metadata.json", encoding="utf-8") as f:
+            metadata = json.load(f)
+        pages = split_pages(metadata["raw_data"], metadata["params"]["page_count"])
+        logger.info(f"按需生成PDF：{book_dir}")
+        if not _build_pdf(book_dir, pages):
+            return None
+        return book_dir / "book.pdf"
+
+def _dispatch_streamed_pages(params, image_gen, executor, manifest, progress_callback=None, use_cache=True):
+    """消费流式故事，每页就绪即登记到清单并提交图片任务，返回 (story, futures)"""
+    story = None
+    visual_tags = None
+    pending = []
+    futures = []
+    # 计时覆盖整个流式读取（含逐页提交图片任务，提交本身不阻塞）
+    with span("generate_story", stream=True) as story_span:
+        for event in generate_story_stream(params, use_cache=use_cache):
+            if event["type"] == "visual_tags":
+                visual_tags = event["visual_tags"] or None
+            elif event["type"] == "page":
+                pending.append((event["page_num"], event["text"]))
+            elif event["type"] == "done":
+                story = event["story"]
+                visual_tags = story["visual_tags"]
+
+            # 可视化标签就绪前暂存页面，保证提示词与非流式模式一致
+            if visual_tags is not None:
+                for page_num, page_text in pending:
+                    plan = plan_page(page_num, page_text, visual_tags)
+                    manifest.add_page(plan)
+                    futures.append(executor.submit(render_page, image_gen, plan,
+                                                   manifest.track(progress_callback), use_cache))
+                pending = []
+        if story is None:
+            story_span.outcome = "error"
+    return story, futures
+
+def _emit(event_callback, event, data=None):
+    """上报生成阶段事件"""
+    if event_callback:
+        event_callback(event, data)
+
+@traced("generate_book")
+def generate_book(params, progress_callback=None, page_concurrency=None, stream=None, use_cache=True,
+                  event_callback=None):
+    """生成完整绘本
+
+    progress_callback(page_num, status, filename=None) 用于上报每页进度，status 取值 running/done/failed，
+    done 时附带页面图片文件名
+    event_callback(event, data) 用于上报阶段事件：build_started（build_id 为构建目录名，发布前页面位于其中）、
+    story_ready（故事就绪）、book_ready（派生图与目录索引完成，PDF可下载；pdf_built 表示PDF是否已生成）
+    page_concurrency 为同时生成的页数，默认读取 PAGE_CONCURRENCY，设为1时逐页生成
+    stream 为 True 时流式生成故事，每页文本就绪即开始生成图片，默认读取 STREAM_STORY
+    use_cache 为 False 时跳过故事与图片缓存
+    """
+    if stream is None:
+        stream = STREAM_STORY
+
+    # 初始化图片生成器（写入临时构建目录，完成后整体发布，避免并发生成互相覆盖半成品）
+    build_dir = new_build_dir(params["theme"])
+    _emit(event_callback, "build_started", {"build_id": build_dir.name})
+    image_gen = VolcBookGenerator(output_dir=build_dir)
+    # 生成清单：记录故事与每页状态，中断或部分失败后可用 resume_book 续跑
+    manifest = BookManifest.create(build_dir, params)
+    tracked_callback = manifest.track(progress_callback)
+
+    # 并发生成每页内容，图片按页码写入 page_NNN.png，单页失败不影响其他页
+    workers = max(1, min(page_concurrency or PAGE_CONCURRENCY, params["page_count"]))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="page") as executor:
+        if stream:
+            story, futures = _dispatch_streamed_pages(params, image_gen, executor, manifest,
+                                                      progress_callback, use_cache)
+            if story:
+                book_dir, pages = prepare_book(params, story, build_dir)
+                manifest.set_story(story["visual_tags"])
+                _emit(event_callback, "story_ready", {"page_count": len(pages)})
+        else:
+            # 生成故事文本
+            story = generate_story(params, use_cache=use_cache)
+            futures = []
+            if story:
+                book_dir, pages = prepare_book(params, story, build_dir)
+                manifest.set_story(story["visual_tags"])
+                _emit(event_callback, "story_ready", {"page_count": len(pages)})
+                for page_num, page_text in enumerate(pages, 1):
+                    plan = plan_page(page_num, page_text, story["visual_tags"])
+                    manifest.add_page(plan)
+                    futures.append(executor.submit(render_page, image_gen, plan, tracked_callback, use_cache))
+        wait(futures)
 
-        # 生成带文字的图片
-        result = image_gen.generate_page(
-            prompt=prompt,
-            page_num=page_num,
-            text_info=text_info
-        )
+    if not story:
+        logger.error("故事生成失败，终止绘本生成")
+        discard_build(build_dir)
+        return None
 
-        if not result:
-            logger.warning(f"第{page_num}页生成失败，跳过...")
-            continue
     # 打印解析后的分页内容
     for i, page in enumerate(pages):
         print("--------")
         print(f"Page {i+1}: {page[:50]}...")
         print("--------")
-    create_pdf(book_dir, pages)
+    book_dir = _finalize_book(params, book_dir, pages)
+    _emit(event_callback, "book_ready", {"pdf_built": PDF_EAGER})
+    return book_dir
+
+@traced("generate_book")
+async def generate_book_async(params, progress_callback=None, page_concurrency=None, use_cache=True,
+                              event_callback=None):
+    """生成完整绘本（asyncio版本，所有页面的图片请求在同一事件循环内并发）"""
+    # 故事生成与PDF排版为阻塞调用，放到线程中执行
+    story = await asyncio.to_thread(generate_story, params, use_cache)
+    if not story:
+        logger.error("故事生成失败，终止绘本生成")
+        return None
+
+    book_dir, pages = await asyncio.to_thread(prepare_book, params, story, new_build_dir(params["theme"]))
+    _emit(event_callback, "build_started", {"build_id": book_dir.name})
+    manifest = BookManifest.create(book_dir, params)
+    manifest.set_story(story["visual_tags"])
+    plans = [plan_page(page_num, page_text, story["visual_tags"]) for page_num, page_text in enumerate(pages, 1)]
+    for plan in plans:
+        manifest.add_page(plan)
+    _emit(event_callback, "story_ready", {"page_count": len(pages)})
+
+    semaphore = asyncio.Semaphore(max(1, page_concurrency or PAGE_CONCURRENCY))
+    tracked_callback = manifest.track(progress_callback)
+
+    async def limited(image_gen, plan):
+        async with semaphore:
+            return await render_page_async(image_gen, plan, tracked_callback, use_cache)
+
+    async with AsyncVolcBookGenerator(output_dir=book_dir) as image_gen:
+        await asyncio.gather(*(limited(image_gen, plan) for plan in plans))
+
+    book_dir = await asyncio.to_thread(_finalize_book, params, book_dir, pages)
+    _emit(event_callback, "book_ready", {"pdf_built": PDF_EAGER})
+    return book_dir
+
+def generate_book_auto(params, stream=None, **kwargs):
+    """按配置选择生成方式：开启 ASYNC_IMAGE_CLIENT 且不流式生成故事时使用 generate_book_async，否则 generate_book
+
+    其余参数与 generate_book 相同
+    """
+    if stream is None:
+        stream = STREAM_STORY
+    if ASYNC_IMAGE_CLIENT and not stream:
+        # 在调用线程内运行独立的事件循环，接口名额与令牌桶仍与其他线程共享
+        return asyncio.run(generate_book_async(params, **kwargs))
+    return generate_book(params, stream=stream, **kwargs)
+
+def find_resumable(theme):
+    """查找可续跑的绘本目录，返回 (目录, 是否为未发布的构建目录)，没有时返回 (None, False)
+
+    优先选择比已发布版本更新的中断残留构建目录（故事已生成），其次是已发布的绘本
+    """
+    if not is_valid_theme(theme):
+        return None, False
+    published = BOOKS_ROOT / theme / "metadata.json"
+    published_mtime = published.stat().st_mtime if published.exists() else 0
+    builds = []
+    if BUILD_ROOT.exists():
+        for build_dir in BUILD_ROOT.iterdir():
+            name, _, suffix = build_dir.name.rpartition("-")
+            metadata_path = build_dir / "metadata.json"
+            if (name == theme and len(suffix) == 8 and build_dir not in _active_builds
+                    and metadata_path.exists() and metadata_path.stat().st_mtime > published_mtime):
+                builds.append(build_dir)
+    if builds:
+        return max(builds, key=lambda d: (d / "metadata.json").stat().st_mtime), True
+    if published_mtime:
+        return published.parent, False
+    return None, False
+
+def _manifest_from_metadata(book_dir):
+    """为没有清单的旧绘本根据 metadata.json 与已有页面补建清单"""
+    with open(book_dir / "metadata.json", encoding="utf-8") as f:
+        metadata = json.load(f)
+    visual_tags = metadata.get("visual_tags")
+    manifest = BookManifest.create(book_dir, metadata["params"])
+    manifest.set_story(visual_tags)
+    for page_num, page_text in enumerate(split_pages(metadata["raw_data"], metadata["params"]["page_count"]), 1):
+        manifest.add_page(plan_page(page_num, page_text, visual_tags))
+        filename = f"page_{page_num:03d}.png"
+        if (book_dir / filename).exists():
+            manifest.mark(page_num, "done", filename)
+    return manifest
+
+def _repair_pages(book_dir, manifest, progress_callback=None, page_concurrency=None, use_cache=True):
+    """只重新生成清单中未完成的页面"""
+    pending = manifest.pending_pages()
+    if not pending:
+        return
+    logger.info(f"续跑{book_dir}：需要重新生成第{[page['page_num'] for page in pending]}页")
+    image_gen = VolcBookGenerator(output_dir=book_dir)
+    tracked_callback = manifest.track(progress_callback)
+    workers = max(1, min(page_concurrency or PAGE_CONCURRENCY, len(pending)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="page") as executor:
+        wait([executor.submit(render_page, image_gen, page, tracked_callback, use_cache) for page in pending])
+
+@traced("resume_book")
+def resume_book(theme, progress_callback=None, page_concurrency=None, use_cache=True, event_callback=None):
+    """续跑/修复绘本：复用清单中的故事与提示词（不再调用大模型），只重新生成缺失或失败的页面与PDF
+
+    中断残留的构建目录续跑完成后发布；已发布的绘本原地修复。无可续跑内容时返回None
+    """
+    book_dir, is_build = find_resumable(theme)
+    if book_dir is None:
+        logger.error(f"没有可续跑的绘本：{theme}")
+        return None
+
+    manifest = BookManifest.load(book_dir)
+    if manifest is None:
+        manifest = _manifest_from_metadata(book_dir)
+    if not manifest.data["story_ready"]:
+        logger.error(f"故事尚未生成，无法续跑：{book_dir}")
+        return None
+
+    params = manifest.data["params"]
+    _emit(event_callback, "story_ready", {"page_count": len(manifest.pages()),
+                                         "pending": len(manifest.pending_pages())})
+    pages = [page["text"] for page in manifest.pages()]
+    if is_build:
+        build_dir = book_dir
+        _active_builds.add(build_dir)
+        _emit(event_callback, "build_started", {"build_id": build_dir.name})
+        try:
+            _repair_pages(build_dir, manifest, progress_callback, page_concurrency, use_cache)
+            book_dir = _finalize_book(params, build_dir, pages)
+        finally:
+            # 出错时保留构建目录供下次续跑，但不能一直标记为进行中
+            _active_builds.discard(build_dir)
+    else:
+        with _publish_lock(theme):
+            _repair_pages(book_dir, manifest, progress_callback, page_concurrency, use_cache)
+        run_cpu(pregenerate_variants, book_dir)
+        get_catalog().upsert(theme)
+
+    # 页面更新后已有PDF过期，重新生成
+    pdf_built = ensure_pdf(book_dir) is not None
+    _emit(event_callback, "book_ready", {"pdf_built": pdf_built})
+    return book_dir
+
 if __name__ == "__main__":
     #
     # from PIL import Image
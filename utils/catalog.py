@@ -0,0 +1,249 @@
+# utils/catalog.py
+import json
+import logging
+import sqlite3
+import threading
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# 目录索引文件名（存放在绘本根目录下）
+CATALOG_FILENAME = ".catalog.sqlite3"
+
+# 允许排序的字段
+SORT_FIELDS = ("updated_at", "created_at", "theme", "style", "page_count")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS books (
+    theme TEXT PRIMARY KEY,
+    style TEXT NOT NULL DEFAULT '',
+    page_count INTEGER NOT NULL DEFAULT 0,
+    images TEXT NOT NULL DEFAULT '[]',
+    has_pdf INTEGER NOT NULL DEFAULT 0,
+    metadata TEXT NOT NULL DEFAULT '{}',
+    metadata_mtime REAL NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_books_style ON books(style);
+CREATE INDEX IF NOT EXISTS idx_books_updated_at ON books(updated_at);
+CREATE INDEX IF NOT EXISTS idx_books_created_at ON books(created_at);
+"""
+
+
+class BookCatalog:
+    """绘本目录索引（SQLite），生成/删除绘本时增量更新，列表查询无需扫描磁盘"""
+
+    def __init__(self, books_dir="books"):
+        self.books_dir = Path(books_dir)
+        self.books_dir.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.books_dir / CATALOG_FILENAME), check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            self._conn.executescript(_SCHEMA)
+        # 单本绘本详情的内存缓存：theme -> (目录签名, 记录)
+        self._details = {}
+        # 按主题区分的发布锁：发布（替换目录）、原地修复与删除期间持有
+        self._publish_locks = {}
+
+    def publish_lock(self, theme):
+        """同一主题的发布、原地修复与删除互斥；目录暂时缺失时读取方据此等待"""
+        with self._lock:
+            return self._publish_locks.setdefault(theme, threading.RLock())
+
+    def wait_published(self, theme):
+        """绘本是否存在：元数据缺失时等待进行中的发布或删除结束后再确认
+
+        发布时旧目录先移走再换入新目录，期间目录短暂缺失，不能直接视为已删除
+        """
+        metadata_path = self.books_dir / theme / "metadata.json"
+        if metadata_path.exists():
+            return True
+        with self._lock:
+            lock = self._publish_locks.get(theme)
+        if lock is None:
+            # 本进程从未发布或删除过该主题，目录缺失即不存在
+            return False
+        with lock:
+            return metadata_path.exists()
+
+    def upsert(self, theme):
+        """读取单本绘本目录并写入索引，目录或元数据不存在时从索引移除"""
+        book_dir = self.books_dir / theme
+        metadata_path = book_dir / "metadata.json"
+        if not self.wait_published(theme):
+            self.remove(theme)
+            return None
+
+        with open(metadata_path, "r", encoding="utf-8") as f:
+            metadata = json.load(f)
+        metadata_mtime = metadata_path.stat().st_mtime
+
+        image_files = sorted(f.name for f in book_dir.glob("page_*.png"))
+        # PDF在首次下载时按需生成，有页面即可下载
+        has_pdf = bool(image_files)
+        params = metadata.get("params", {})
+        updated_at = max([metadata_mtime] + [(book_dir / name).stat().st_mtime for name in image_files])
+
+        with self._lock, self._conn:
+            self._conn.execute(
+                """
+                INSERT INTO books (theme, style, page_count, images, has_pdf, metadata,
+                                   metadata_mtime, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(theme) DO UPDATE SET
+                    style = excluded.style,
+                    page_count = excluded.page_count,
+                    images = excluded.images,
+                    has_pdf = excluded.has_pdf,
+                    metadata = excluded.metadata,
+                    metadata_mtime = excluded.metadata_mtime,
+                    updated_at = excluded.updated_at
+                """,
+                (
+                    theme,
+                    params.get("style", ""),
+                    # 请求的页数（缺页的绘本不会显示为更少的页，重新生成时也按原页数）；已有图片见 images
+                    params.get("page_count") or len(image_files),
+                    json.dumps(image_files, ensure_ascii=False),
+                    int(has_pdf),
+                    json.dumps(metadata, ensure_ascii=False),
+                    metadata_mtime,
+                    metadata_mtime,
+                    updated_at,
+                ),
+            )
+        return theme
+
+    def remove(self, theme):
+        """从索引中移除绘本"""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM books WHERE theme = ?", (theme,))
+            self._details.pop(theme, None)
+
+    def sync(self):
+        """与磁盘目录对账：补充新增、刷新变更、删除已不存在的绘本"""
+        with self._lock:
+            indexed = {
+                row["theme"]: row["metadata_mtime"]
+                for row in self._conn.execute("SELECT theme, metadata_mtime FROM books")
+            }
+
+        on_disk = set()
+        for book_dir in self.books_dir.iterdir():
+            if not book_dir.is_dir() or book_dir.name.startswith("."):
+                continue
+            metadata_path = book_dir / "metadata.json"
+            if not metadata_path.exists():
+                continue
+            on_disk.add(book_dir.name)
+            if indexed.get(book_dir.name) != metadata_path.stat().st_mtime:
+                try:
+                    self.upsert(book_dir.name)
+                except Exception as e:
+                    # 记录单本绘本的错误，但继续处理其他绘本
+                    logger.error(f"索引绘本 {book_dir.name} 时出错: {str(e)}")
+
+        for theme in set(indexed) - on_disk:
+            # 扫描时恰逢发布替换目录的绘本在发布结束后重新索引，确实已删除的由 upsert 移出索引
+            try:
+                if self.upsert(theme):
+                    on_disk.add(theme)
+            except Exception as e:
+                logger.error(f"索引绘本 {theme} 时出错: {str(e)}")
+        logger.info(f"绘本目录索引已同步：共{len(on_disk)}本")
+
+    def query(self, page=1, page_size=50, sort="updated_at", order="desc", theme=None, style=None):
+        """分页查询，返回 (总数, 绘本列表)"""
+        if sort not in SORT_FIELDS:
+            sort = "updated_at"
+        order = "ASC" if str(order).lower() == "asc" else "DESC"
+
+        conditions = []
+        args = []
+        if theme:
+            conditions.append("theme LIKE ?")
+            args.append(f"%{theme}%")
+        if style:
+            conditions.append("style = ?")
+            args.append(style)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+        with self._lock:
+            total = self._conn.execute(f"SELECT COUNT(*) FROM books {where}", args).fetchone()[0]
+            # 列表只取摘要字段，不读取体积较大的 metadata 列
+            rows = self._conn.execute(
+                f"SELECT theme, style, page_count, images, has_pdf, updated_at FROM books {where} "
+                f"ORDER BY {sort} {order}, theme ASC LIMIT ? OFFSET ?",
+                args + [page_size, (page - 1) * page_size],
+            ).fetchall()
+
+        return total, [self._row_to_summary(row) for row in rows]
+
+    def get(self, theme):
+        """获取单本绘本的完整记录（含元数据），不存在时返回None"""
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM books WHERE theme = ?", (theme,)).fetchone()
+        if row is None:
+            return None
+        return {
+            "theme": row["theme"],
+            "images": json.loads(row["images"]),
+            "metadata": json.loads(row["metadata"]),
+            "has_pdf": bool(row["has_pdf"]),
+            "updated_at": row["updated_at"],
+        }
+
+    def _signature(self, theme):
+        """绘本目录签名：目录与元数据的修改时间（页面文件新增、替换或删除都会改变目录的修改时间）"""
+        book_dir = self.books_dir / theme
+        try:
+            return (book_dir.stat().st_mtime_ns, (book_dir / "metadata.json").stat().st_mtime_ns)
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+
+    def detail(self, theme):
+        """获取单本绘本详情（内存缓存，目录签名变化时重新读取磁盘并刷新索引），不存在时返回None"""
+        signature = self._signature(theme)
+        if signature is None and self.wait_published(theme):
+            signature = self._signature(theme)
+        if signature is None:
+            if self._details.get(theme) is not None or self.get(theme) is not None:
+                self.remove(theme)
+            return None
+
+        cached = self._details.get(theme)
+        if cached and cached[0] == signature:
+            return cached[1]
+
+        self.upsert(theme)
+        record = self.get(theme)
+        with self._lock:
+            self._details[theme] = (signature, record)
+        return record
+
+    @staticmethod
+    def _row_to_summary(row):
+        images = json.loads(row["images"])
+        return {
+            "theme": row["theme"],
+            "style": row["style"],
+            "page_count": row["page_count"],
+            "cover": images[0] if images else None,
+            "has_pdf": bool(row["has_pdf"]),
+            "updated_at": row["updated_at"],
+        }
+
+
+_catalogs = {}
+_catalogs_lock = threading.Lock()
+
+
+def get_catalog(books_dir="books"):
+    """获取进程内共享的目录索引（按绘本根目录区分）"""
+    key = str(Path(books_dir).resolve())
+    with _catalogs_lock:
+        if key not in _catalogs:
+            _catalogs[key] = BookCatalog(books_dir)
+        return _catalogs[key]
@@ -0,0 +1,64 @@
+# utils/cpu_pool.py
+import os
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+logger = logging.getLogger(__name__)
+
+# CPU密集型阶段（文字叠加、PDF排版）的进程数，0表示在调用线程内直接执行
+CPU_WORKERS = int(os.getenv("CPU_WORKERS", os.cpu_count() or 1))
+# 子进程启动方式，默认spawn，避免在多线程的Flask进程中fork
+# spawn 子进程会以 __mp_main__ 重新导入入口模块，入口模块不能在导入时执行启动步骤（见 app.startup）
+CPU_POOL_START_METHOD = os.getenv("CPU_POOL_START_METHOD", "spawn")
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_cpu_pool():
+    """获取进程内共享的CPU进程池，未启用时返回None"""
+    global _pool
+    if CPU_WORKERS <= 0:
+        return None
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ProcessPoolExecutor(
+                    max_workers=CPU_WORKERS,
+                    mp_context=multiprocessing.get_context(CPU_POOL_START_METHOD),
+                )
+                logger.info(f"CPU进程池已启动：{CPU_WORKERS}个进程（{CPU_POOL_START_METHOD}）")
+    return _pool
+
+
+def _reset_pool():
+    """进程池损坏（子进程异常退出）后丢弃，下次调用时重建"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+def run_cpu(func, *args, **kwargs):
+    """在CPU进程池中执行函数并等待结果；进程池未启用或已损坏时在当前线程执行
+
+    func 及其参数、返回值需可被 pickle（模块级函数）
+    """
+    pool = get_cpu_pool()
+    if pool is None:
+        return func(*args, **kwargs)
+    try:
+        return pool.submit(func, *args, **kwargs).result()
+    except BrokenProcessPool as e:
+        logger.error(f"CPU进程池异常，改为在当前线程执行：{str(e)}")
+        _reset_pool()
+        return func(*args, **kwargs)
+
+
+def shutdown():
+    """关闭进程池"""
+    _reset_pool()
@@ -0,0 +1,81 @@
+# utils/fonts.py
+import os
+import logging
+import threading
+from functools import lru_cache
+from PIL import Image, ImageDraw, ImageFont
+
+logger = logging.getLogger(__name__)
+
+# 各用途的候选字体（按顺序取第一个存在的文件），可通过环境变量指定首选路径
+FONT_CANDIDATES = {
+    "overlay": [
+        os.getenv("OVERLAY_FONT_PATH"),
+        "/Library/Fonts/SourceHanSerifSC-Regular.otf",  # 思源宋体
+        "/System/Library/Fonts/Supplemental/Songti.ttc",
+        "/usr/share/fonts/opentype/noto/NotoSerifCJK-Regular.ttc",
+        "/usr/share/fonts/opentype/noto/NotoSansCJK-Regular.ttc",
+        "/usr/share/fonts/truetype/wqy/wqy-zenhei.ttc",
+    ],
+    "pdf": [
+        os.getenv("PDF_FONT_PATH"),
+        "/Library/Fonts/SourceHanSerifSC-Regular.otf",  # 思源宋体
+        "/usr/share/fonts/opentype/noto/NotoSerifCJK-Regular.ttc",
+        "/usr/share/fonts/opentype/noto/NotoSansCJK-Regular.ttc",
+        "/usr/share/fonts/truetype/wqy/wqy-zenhei.ttc",
+    ],
+}
+
+_verify_lock = threading.Lock()
+
+
+@lru_cache(maxsize=None)
+def resolve_font_path(role="overlay"):
+    """解析指定用途的字体路径（每个进程只查找一次），找不到时返回None"""
+    for path in FONT_CANDIDATES.get(role, []):
+        if path and os.path.exists(path):
+            logger.info(f"字体已解析（{role}）：{path}")
+            return path
+    logger.warning(f"未找到可用字体（{role}），候选：{[p for p in FONT_CANDIDATES.get(role, []) if p]}")
+    return None
+
+
+@lru_cache(maxsize=64)
+def get_font(path, size, index=0):
+    """获取已加载的字体对象，按 (path, size, index) 缓存；路径为空或加载失败时返回None
+
+    不回退到 Pillow 默认字体：默认字体不含中文字形，绘制出的文字全是方框
+    """
+    if not path:
+        return None
+    try:
+        return ImageFont.truetype(path, size, index=index)
+    except OSError as e:
+        logger.error(f"字体加载失败：{path} {str(e)}")
+        return None
+
+
+def _glyph_bitmap(font, char):
+    """单个字符的渲染结果（用于比较字形）"""
+    image = Image.new("L", (64, 64))
+    ImageDraw.Draw(image).text((8, 8), char, font=font, fill=255)
+    return image.tobytes()
+
+
+@lru_cache(maxsize=None)
+def verify_font(path, index=0):
+    """验证字体可用性与中文支持（每个路径只验证一次），返回是否可用"""
+    with _verify_lock:
+        try:
+            if not path or not os.path.exists(path):
+                raise FileNotFoundError(f"未找到字体文件：{path}")
+
+            test_font = ImageFont.truetype(path, 36, index=index)
+            # 缺字时绘制的是 .notdef 字形，与私用区字符的渲染结果相同
+            if _glyph_bitmap(test_font, "测") == _glyph_bitmap(test_font, "\U0010FFFD"):
+                raise ValueError(f"字体不含中文字形：{path}")
+            logger.info("字体验证成功")
+            return True
+        except Exception as e:
+            logger.error(f"字体验证失败：{str(e)}")
+            return False
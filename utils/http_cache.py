@@ -0,0 +1,47 @@
+# utils/http_cache.py
+import os
+import hashlib
+from functools import lru_cache
+from pathlib import Path
+from flask import send_file
+
+# 带版本参数（?v=）的URL内容不会变化，允许浏览器/CDN长期缓存
+IMMUTABLE_MAX_AGE = int(os.getenv("IMMUTABLE_MAX_AGE", 365 * 24 * 3600))
+# 计算内容哈希时的分块大小
+_HASH_CHUNK_SIZE = 1024 * 1024
+
+
+@lru_cache(maxsize=4096)
+def _file_digest(path, mtime_ns, size):
+    """按 (路径, 修改时间, 大小) 缓存文件的SHA-256，文件被替换后自动重新计算"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(_HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def content_etag(path):
+    """基于文件内容的强ETag"""
+    stat = os.stat(path)
+    return _file_digest(str(path), stat.st_mtime_ns, stat.st_size)
+
+
+def send_cached_file(path, mimetype=None, immutable=False):
+    """发送文件：内容哈希强ETag、条件请求（304）与Range分段下载
+
+    immutable=True 时返回长期缓存头，否则要求客户端每次使用前重新验证
+    """
+    path = Path(path).resolve()
+    response = send_file(
+        path,
+        mimetype=mimetype,
+        conditional=True,
+        etag=content_etag(path),
+        max_age=IMMUTABLE_MAX_AGE if immutable else None,
+    )
+    if immutable:
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.no_cache = True
+    return response
@@ -0,0 +1,104 @@
+# utils/image_cache.py
+import os
+import json
+import shutil
+import hashlib
+import logging
+import threading
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# 图片缓存配置
+IMAGE_CACHE_ENABLED = os.getenv("IMAGE_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+IMAGE_CACHE_DIR = os.getenv("IMAGE_CACHE_DIR", ".cache/images")
+IMAGE_CACHE_MAX_BYTES = int(os.getenv("IMAGE_CACHE_MAX_BYTES", 2 * 1024 ** 3))
+
+
+def request_key(request_body):
+    """根据图片请求体计算内容哈希（text_info 为本地叠加参数，不参与计算）"""
+    body = {k: v for k, v in request_body.items() if k != "text_info"}
+    payload = json.dumps(body, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ImageCache:
+    """基于磁盘的图片缓存（内容寻址，按总字节数LRU淘汰）"""
+
+    def __init__(self, cache_dir=IMAGE_CACHE_DIR, max_bytes=IMAGE_CACHE_MAX_BYTES):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, key):
+        # 按前两位分桶，避免单目录文件过多
+        return self.cache_dir / key[:2] / f"{key}.png"
+
+    def get(self, key):
+        """返回缓存文件路径，未命中返回None"""
+        path = self._path(key)
+        try:
+            os.utime(path)  # 记录最近访问时间
+        except FileNotFoundError:
+            return None
+        return path
+
+    def put(self, key, content: bytes):
+        """写入原始图片字节并返回缓存路径"""
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f"{path.name}.{threading.get_ident()}.tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+        self._evict()
+        return path
+
+    @staticmethod
+    def materialize(cached_path, save_path):
+        """将缓存文件复制到目标位置
+
+        不使用硬链接：PDF与派生图按页面修改时间判断是否过期，页面不能与缓存文件共享inode
+        """
+        save_path = Path(save_path)
+        tmp_path = save_path.with_name(f".{save_path.name}.{threading.get_ident()}.tmp")
+        shutil.copyfile(cached_path, tmp_path)
+        os.replace(tmp_path, save_path)
+        return save_path
+
+    def _evict(self):
+        """总字节数超过上限时淘汰最久未访问的文件"""
+        if not self.max_bytes:
+            return
+        with self._lock:
+            entries = []
+            for path in self.cache_dir.glob("*/*.png"):
+                try:
+                    stat = path.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                path.unlink(missing_ok=True)
+                total -= size
+                logger.info(f"图片缓存已淘汰：{path.name}")
+
+
+_image_cache = None
+_image_cache_lock = threading.Lock()
+
+
+def get_image_cache():
+    """获取进程内共享的图片缓存，未启用时返回None"""
+    global _image_cache
+    if not IMAGE_CACHE_ENABLED:
+        return None
+    if _image_cache is None:
+        with _image_cache_lock:
+            if _image_cache is None:
+                _image_cache = ImageCache()
+    return _image_cache
@@ -0,0 +1,104 @@
+# utils/image_variants.py
+import io
+import os
+import logging
+import threading
+from pathlib import Path
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# 派生图配置
+VARIANT_WIDTHS = tuple(sorted(int(w) for w in os.getenv("VARIANT_WIDTHS", "320,640,1024").split(",")))
+VARIANT_QUALITY = int(os.getenv("VARIANT_QUALITY", 80))
+# 生成绘本时预先生成的宽度（其余宽度在首次请求时生成）
+VARIANT_PREGENERATE_WIDTHS = tuple(
+    int(w) for w in os.getenv("VARIANT_PREGENERATE_WIDTHS", "320").split(",") if w.strip()
+)
+VARIANTS_DIRNAME = ".variants"
+
+# 支持的输出格式：名称 -> (PIL格式, 扩展名, MIME类型)
+VARIANT_FORMATS = {
+    "webp": ("WEBP", "webp", "image/webp"),
+    "jpeg": ("JPEG", "jpg", "image/jpeg"),
+}
+
+_locks = {}
+_locks_guard = threading.Lock()
+
+
+def _lock_for(path):
+    """同一派生图只生成一次，并发请求等待同一把锁"""
+    with _locks_guard:
+        return _locks.setdefault(str(path), threading.Lock())
+
+
+def snap_width(width):
+    """将请求宽度对齐到预设宽度（取不小于请求值的最小档位）"""
+    for candidate in VARIANT_WIDTHS:
+        if width <= candidate:
+            return candidate
+    return VARIANT_WIDTHS[-1]
+
+
+def negotiate_format(fmt, accept_header=""):
+    """解析请求格式，auto 时根据 Accept 头选择 webp 或 jpeg"""
+    if fmt in VARIANT_FORMATS:
+        return fmt
+    return "webp" if "image/webp" in (accept_header or "") else "jpeg"
+
+
+def variant_path(book_dir, filename, width, fmt):
+    """派生图缓存路径"""
+    _, ext, _ = VARIANT_FORMATS[fmt]
+    return Path(book_dir) / VARIANTS_DIRNAME / f"{Path(filename).stem}_w{width}.{ext}"
+
+
+def render_variant(source, width, fmt):
+    """将原图缩放并编码为派生图，返回字节"""
+    pil_format, _, _ = VARIANT_FORMATS[fmt]
+    buffer = io.BytesIO()
+    with Image.open(source) as image:
+        image = image.convert("RGB")
+        if image.width > width:
+            image.thumbnail((width, width * image.height // image.width), Image.LANCZOS)
+        save_options = {"method": 4} if fmt == "webp" else {"optimize": True, "progressive": True}
+        image.save(buffer, pil_format, quality=VARIANT_QUALITY, **save_options)
+    return buffer.getvalue()
+
+
+def get_variant(book_dir, filename, width, fmt):
+    """返回派生图路径，不存在或早于原图时重新生成"""
+    source = Path(book_dir) / filename
+    target = variant_path(book_dir, filename, width, fmt)
+    source_mtime = source.stat().st_mtime
+
+    if target.exists() and target.stat().st_mtime >= source_mtime:
+        return target
+
+    with _lock_for(target):
+        # 等锁期间可能已由其他请求生成
+        if target.exists() and target.stat().st_mtime >= source_mtime:
+            return target
+
+        # 不创建上级目录：发布替换期间绘本目录暂时缺失，重建会导致换入失败
+        target.parent.mkdir(exist_ok=True)
+        # 临时文件名区分进程与线程：_lock_for 只在进程内互斥，进程池中的预生成可能同时写同一派生图
+        tmp_path = target.with_name(f".{target.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(render_variant(source, width, fmt))
+        os.replace(tmp_path, target)
+        logger.info(f"派生图生成成功：{target}")
+        return target
+
+
+def pregenerate_variants(book_dir):
+    """为绘本的所有页面预先生成常用尺寸的派生图"""
+    book_dir = Path(book_dir)
+    for source in sorted(book_dir.glob("page_*.png")):
+        for width in VARIANT_PREGENERATE_WIDTHS:
+            for fmt in VARIANT_FORMATS:
+                try:
+                    get_variant(book_dir, source.name, snap_width(width), fmt)
+                except Exception as e:
+                    logger.error(f"派生图生成失败 {source.name}: {str(e)}")
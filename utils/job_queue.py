@@ -0,0 +1,203 @@
+# utils/job_queue.py
+import os
+import time
+import uuid
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# 后台生成任务的最大并发数
+BOOK_WORKERS = int(os.getenv("BOOK_WORKERS", 2))
+# 已结束任务在内存中保留的时长（秒）
+JOB_TTL = int(os.getenv("JOB_TTL", 3600))
+
+# 任务结束时的事件类型（事件流的最后一条）
+TERMINAL_EVENT = "done"
+
+
+class JobQueue:
+    """绘本生成任务队列（有界线程池 + 任务状态表 + 每个任务的事件流）"""
+
+    def __init__(self, max_workers=BOOK_WORKERS, job_ttl=JOB_TTL):
+        self.max_workers = max_workers
+        self.job_ttl = job_ttl
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="book-job")
+        self._jobs = {}
+        self._events = {}
+        # 进行中任务的去重键 -> 任务ID（相同请求复用同一任务）
+        self._inflight = {}
+        self._lock = threading.Lock()
+        # 有新事件时唤醒等待事件流的订阅者
+        self._changed = threading.Condition(self._lock)
+
+    def submit(self, func, params, total=None, key=None, **kwargs):
+        """提交任务，立即返回任务ID
+
+        total 为进度总数（默认取 params 中的 page_count）；
+        key 为去重键，已有相同键的任务在排队或执行中时直接返回该任务ID，不重复执行；
+        其余关键字参数原样传给 func
+        """
+        job_id, _ = self.submit_once(func, params, total=total, key=key, **kwargs)
+        return job_id
+
+    def submit_once(self, func, params, total=None, key=None, **kwargs):
+        """同 submit，返回 (任务ID, 是否复用了进行中的任务)"""
+        job_id = uuid.uuid4().hex
+        if total is None:
+            total = params.get("page_count", 0)
+        job = {
+            "id": job_id,
+            "status": "queued",
+            "params": params,
+            "progress": {"total": total, "done": 0, "failed": 0, "pages": {}},
+            "result": None,
+            "error": None,
+            "created_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+        }
+        with self._lock:
+            if key is not None and key in self._inflight:
+                logger.info(f"相同请求复用进行中的任务：{self._inflight[key]}")
+                return self._inflight[key], True
+            self._purge_expired()
+            job["key"] = key
+            self._jobs[job_id] = job
+            self._events[job_id] = []
+            if key is not None:
+                self._inflight[key] = job_id
+            self._append_event(job_id, "status", {"status": "queued"})
+        self._executor.submit(self._run, job_id, func, params, kwargs)
+        logger.info(f"任务已入队：{job_id} {params}")
+        return job_id, False
+
+    def _run(self, job_id, func, params, kwargs):
+        """在工作线程中执行任务
+
+        func 的签名为 func(params, progress_callback, event_callback, **kwargs)
+        """
+        self._update(job_id, status="running", started_at=time.time())
+        self.emit(job_id, "status", {"status": "running"})
+        try:
+            result = func(params, progress_callback=self._progress_callback(job_id),
+                          event_callback=self._event_callback(job_id), **kwargs)
+            if result is None:
+                self._finish(job_id, status="failed", error="生成失败，请重试")
+            else:
+                self._finish(job_id, status="succeeded", result=result)
+        except Exception as e:
+            logger.error(f"任务执行失败 {job_id}: {str(e)}")
+            self._finish(job_id, status="failed", error=str(e))
+
+    def _progress_callback(self, job_id):
+        """生成每页状态回调，同时写入事件流（页面完成时附带图片文件名）"""
+        def callback(page_num, status, filename=None):
+            with self._lock:
+                job = self._jobs.get(job_id)
+                if not job:
+                    return
+                progress = job["progress"]
+                progress["pages"][page_num] = status
+                progress["done"] = sum(1 for s in progress["pages"].values() if s == "done")
+                progress["failed"] = sum(1 for s in progress["pages"].values() if s == "failed")
+                data = {"page_num": page_num, "status": status}
+                if filename:
+                    data["filename"] = filename
+                self._append_event(job_id, "page", data)
+        return callback
+
+    def _event_callback(self, job_id):
+        """生成阶段事件回调（story_ready、book_ready 等）"""
+        def callback(event, data=None):
+            self.emit(job_id, event, data)
+        return callback
+
+    def _update(self, job_id, **fields):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job:
+                job.update(fields)
+
+    def _finish(self, job_id, status, result=None, error=None):
+        """标记任务结束并写入结束事件（同一把锁内完成，订阅者不会错过结束事件）"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if not job:
+                return
+            job.update(status=status, result=result, error=error, finished_at=time.time())
+            if self._inflight.get(job.get("key")) == job_id:
+                del self._inflight[job["key"]]
+            self._append_event(job_id, TERMINAL_EVENT, {"status": status, "error": error})
+
+    def _append_event(self, job_id, event, data):
+        """追加事件并唤醒订阅者（调用方需持有锁）"""
+        events = self._events.get(job_id)
+        if events is None:
+            return
+        events.append({"id": len(events) + 1, "event": event, "data": data or {}, "time": time.time()})
+        self._changed.notify_all()
+
+    def emit(self, job_id, event, data=None):
+        """向任务事件流写入一条事件"""
+        with self._lock:
+            self._append_event(job_id, event, data)
+
+    def last_event(self, job_id, event):
+        """任务事件流中最近一条指定类型事件的数据，没有时返回None"""
+        with self._lock:
+            for item in reversed(self._events.get(job_id, [])):
+                if item["event"] == event:
+                    return item["data"]
+        return None
+
+    def wait_events(self, job_id, after=0, timeout=None):
+        """返回ID大于 after 的事件，没有新事件时最多等待 timeout 秒
+
+        返回 (事件列表, 任务是否已结束)，任务不存在时返回None
+        """
+        with self._changed:
+            self._changed.wait_for(
+                lambda: job_id not in self._events or len(self._events[job_id]) > after,
+                timeout=timeout,
+            )
+            events = self._events.get(job_id)
+            if events is None:
+                return None
+            return events[after:], self._jobs[job_id]["finished_at"] is not None
+
+    def _purge_expired(self):
+        """清理过期的已结束任务（调用方需持有锁）"""
+        now = time.time()
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job["finished_at"] and now - job["finished_at"] > self.job_ttl
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+            self._events.pop(job_id, None)
+
+    def get(self, job_id):
+        """获取任务快照"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if not job:
+                return None
+            snapshot = dict(job)
+            snapshot["progress"] = dict(job["progress"], pages=dict(job["progress"]["pages"]))
+            return snapshot
+
+    def counts(self):
+        """按状态统计内存中的任务数（queued/running 即进行中的任务）"""
+        counts = dict.fromkeys(("queued", "running", "succeeded", "failed"), 0)
+        with self._lock:
+            for job in self._jobs.values():
+                counts[job["status"]] = counts.get(job["status"], 0) + 1
+        return counts
+
+    def list(self):
+        """列出所有任务快照"""
+        with self._lock:
+            job_ids = list(self._jobs)
+        return [job for job in (self.get(job_id) for job_id in job_ids) if job]
@@ -0,0 +1,112 @@
+# utils/manifest.py
+import os
+import json
+import time
+import threading
+from pathlib import Path
+
+# 清单文件名（与 metadata.json 同目录）
+MANIFEST_FILENAME = "manifest.json"
+
+
+class BookManifest:
+    """绘本生成清单：记录故事（可视化标签与每页文本）、每页提示词与完成状态，用于中断后续跑
+
+    每次状态变化都原子写回磁盘，进程崩溃后清单仍与已写入的页面一致
+    """
+
+    def __init__(self, book_dir, data):
+        self.book_dir = Path(book_dir)
+        self.data = data
+        self._lock = threading.Lock()
+
+    @property
+    def path(self):
+        return self.book_dir / MANIFEST_FILENAME
+
+    @classmethod
+    def create(cls, book_dir, params):
+        """新建清单（故事尚未生成）"""
+        now = time.time()
+        manifest = cls(book_dir, {
+            "params": params,
+            "visual_tags": None,
+            "story_ready": False,
+            "pages": {},
+            "created_at": now,
+            "updated_at": now,
+        })
+        manifest.save()
+        return manifest
+
+    @classmethod
+    def load(cls, book_dir):
+        """读取清单，不存在或损坏时返回None"""
+        path = Path(book_dir) / MANIFEST_FILENAME
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return cls(book_dir, json.load(f))
+        except (OSError, ValueError):
+            return None
+
+    def save(self):
+        """原子写回清单（调用方无需持锁，内部串行化）"""
+        with self._lock:
+            self._write()
+
+    def _write(self):
+        self.data["updated_at"] = time.time()
+        self.book_dir.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_name(f".{MANIFEST_FILENAME}.{threading.get_ident()}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def set_story(self, visual_tags):
+        """故事已生成（页面条目由 add_page 逐页登记）"""
+        with self._lock:
+            self.data["visual_tags"] = visual_tags
+            self.data["story_ready"] = True
+            self._write()
+
+    def add_page(self, plan):
+        """登记一页的生成计划：{"page_num", "text", "prompt", "text_info"}"""
+        with self._lock:
+            self.data["pages"][str(plan["page_num"])] = dict(plan, status="pending", filename=None)
+            self._write()
+
+    def mark(self, page_num, status, filename=None):
+        """更新单页状态（running/done/failed）"""
+        with self._lock:
+            page = self.data["pages"].get(str(page_num))
+            if page is None:
+                return
+            page["status"] = status
+            if filename:
+                page["filename"] = filename
+            page["updated_at"] = time.time()
+            self._write()
+
+    def track(self, progress_callback=None):
+        """包装进度回调：先记录到清单再转发"""
+        def callback(page_num, status, filename=None):
+            self.mark(page_num, status, filename)
+            if progress_callback:
+                progress_callback(page_num, status, filename)
+        return callback
+
+    def pages(self):
+        """按页码排序的页面条目"""
+        return [self.data["pages"][key] for key in sorted(self.data["pages"], key=int)]
+
+    def pending_pages(self):
+        """未完成的页面：状态不是 done，或记录的图片文件已不存在"""
+        return [
+            page for page in self.pages()
+            if page["status"] != "done" or not page.get("filename")
+            or not (self.book_dir / page["filename"]).exists()
+        ]
+
+    def is_complete(self):
+        """故事已生成且所有页面均已完成"""
+        return bool(self.data["story_ready"] and self.data["pages"] and not self.pending_pages())
@@ -0,0 +1,195 @@
+# utils/metrics.py
+import os
+import time
+import json
+import bisect
+import inspect
+import logging
+import functools
+import threading
+import contextvars
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# 阶段耗时直方图的桶上界（秒）
+METRICS_BUCKETS = tuple(sorted(
+    float(b) for b in os.getenv("METRICS_BUCKETS", "0.005,0.01,0.05,0.1,0.25,0.5,1,2.5,5,10,30,60,120").split(",")
+    if b.strip()
+))
+# 指标名前缀
+METRICS_PREFIX = "storybook"
+
+# 当前上下文中进行中的span（线程与asyncio任务各自独立），用于把重试计入最内层span
+_current_spans = contextvars.ContextVar("metrics_spans", default=())
+
+
+class Span:
+    """一次阶段计时：stage 为阶段名，retries 为期间 tenacity 的重试次数，attrs 为附加到日志的字段"""
+
+    def __init__(self, stage, attrs):
+        self.stage = stage
+        self.attrs = attrs
+        self.retries = 0
+        self.outcome = "ok"
+
+
+class Metrics:
+    """进程内指标注册表：各阶段耗时直方图、重试计数与按需采集的仪表值，输出Prometheus文本格式"""
+
+    def __init__(self, buckets=METRICS_BUCKETS):
+        self.buckets = buckets
+        # (stage, outcome) -> [各桶计数..., 总数, 总和]
+        self._histograms = {}
+        self._retries = {}
+        # name -> (help, collect)，collect() 返回 [(labels, value), ...]
+        self._gauges = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage, seconds, outcome="ok"):
+        """记录一次阶段耗时"""
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            series = self._histograms.setdefault((stage, outcome), [0] * (len(self.buckets) + 2))
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += 1
+            series[-1] += seconds
+
+    def inc_retry(self, stage):
+        """记录一次重试"""
+        with self._lock:
+            self._retries[stage] = self._retries.get(stage, 0) + 1
+
+    def register_gauge(self, name, help_text, collect):
+        """注册仪表，采集函数在每次导出时调用"""
+        with self._lock:
+            self._gauges[name] = (help_text, collect)
+
+    def render(self):
+        """导出Prometheus文本格式"""
+        with self._lock:
+            histograms = {key: list(series) for key, series in self._histograms.items()}
+            retries = dict(self._retries)
+            gauges = dict(self._gauges)
+
+        name = f"{METRICS_PREFIX}_stage_duration_seconds"
+        lines = [f"# HELP {name} 各生成阶段耗时（秒）", f"# TYPE {name} histogram"]
+        for (stage, outcome), series in sorted(histograms.items()):
+            labels = {"stage": stage, "outcome": outcome}
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f"{name}_bucket{_labels(labels, le=_number(bound))} {cumulative}")
+            lines.append(f"{name}_bucket{_labels(labels, le='+Inf')} {series[-2]}")
+            lines.append(f"{name}_sum{_labels(labels)} {_number(series[-1])}")
+            lines.append(f"{name}_count{_labels(labels)} {series[-2]}")
+
+        name = f"{METRICS_PREFIX}_retries_total"
+        lines += [f"# HELP {name} tenacity 重试次数（按阶段）", f"# TYPE {name} counter"]
+        lines += [f"{name}{_labels({'stage': stage})} {count}" for stage, count in sorted(retries.items())]
+
+        for gauge_name, (help_text, collect) in sorted(gauges.items()):
+            gauge_name = f"{METRICS_PREFIX}_{gauge_name}"
+            lines += [f"# HELP {gauge_name} {help_text}", f"# TYPE {gauge_name} gauge"]
+            try:
+                samples = collect()
+            except Exception as e:
+                logger.error(f"指标采集失败 {gauge_name}: {str(e)}")
+                continue
+            lines += [f"{gauge_name}{_labels(labels)} {_number(value)}" for labels, value in samples]
+        return "\n".join(lines) + "\n"
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _escape(value):
+    """转义标签值中的反斜杠、双引号与换行"""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels, **extra):
+    labels = dict(labels, **extra)
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+
+_metrics = None
+_metrics_lock = threading.Lock()
+
+
+def get_metrics():
+    """获取进程内共享的指标注册表"""
+    global _metrics
+    if _metrics is None:
+        with _metrics_lock:
+            if _metrics is None:
+                _metrics = Metrics()
+    return _metrics
+
+
+@contextmanager
+def span(stage, **attrs):
+    """计时一个阶段：结束时写入直方图，并输出一行结构化日志（JSON，DEBUG级别）
+
+    块内抛出异常时 outcome 为 error；调用方也可将 span.outcome 设为 error 表示失败
+    """
+    current = Span(stage, attrs)
+    token = _current_spans.set(_current_spans.get() + (current,))
+    started = time.perf_counter()
+    try:
+        yield current
+    except BaseException:
+        current.outcome = "error"
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        _current_spans.reset(token)
+        get_metrics().observe(stage, elapsed, current.outcome)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("span " + json.dumps({
+                "stage": stage, "duration_ms": round(elapsed * 1000, 1), "outcome": current.outcome,
+                "retries": current.retries, **attrs,
+            }, ensure_ascii=False, default=str))
+
+
+def traced(stage):
+    """装饰器：以 span 计时整个调用（置于 @retry 之上时包含全部重试），返回None视为失败
+
+    支持普通函数与协程函数
+    """
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(stage) as current:
+                    result = await func(*args, **kwargs)
+                    if result is None:
+                        current.outcome = "error"
+                    return result
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(stage) as current:
+                result = func(*args, **kwargs)
+                if result is None:
+                    current.outcome = "error"
+                return result
+        return wrapper
+    return decorator
+
+
+def record_retry(retry_state):
+    """tenacity before_sleep 回调：计入最内层进行中的span（没有时按函数名）"""
+    spans = _current_spans.get()
+    if spans:
+        spans[-1].retries += 1
+        stage = spans[-1].stage
+    else:
+        stage = getattr(retry_state.fn, "__name__", "unknown")
+    get_metrics().inc_retry(stage)
+    logger.info(f"{stage} 第{retry_state.attempt_number}次尝试失败，准备重试：{retry_state.outcome.exception()}")
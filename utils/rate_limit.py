@@ -0,0 +1,309 @@
+# utils/rate_limit.py
+import os
+import time
+import random
+import asyncio
+import logging
+import threading
+from contextlib import contextmanager, asynccontextmanager
+from email.utils import parsedate_to_datetime
+
+logger = logging.getLogger(__name__)
+
+# 各外部接口在进程内允许同时进行的请求数，0表示不限制
+API_CONCURRENCY = {
+    "text": int(os.getenv("TEXT_API_CONCURRENCY", 4)),
+    "image": int(os.getenv("IMAGE_API_CONCURRENCY", 8)),
+}
+# 各外部接口的请求速率（每秒请求数）与突发容量，速率为0表示不限制
+API_RATE = {
+    "text": float(os.getenv("TEXT_API_QPS", 5)),
+    "image": float(os.getenv("IMAGE_API_QPS", 2)),
+}
+API_BURST = {
+    "text": float(os.getenv("TEXT_API_BURST", 0)) or None,
+    "image": float(os.getenv("IMAGE_API_BURST", 0)) or None,
+}
+# 自适应调速：被限流时速率乘以该系数，之后每次成功恢复配置速率的一定比例（AIMD）
+RATE_BACKOFF_FACTOR = float(os.getenv("RATE_BACKOFF_FACTOR", 0.5))
+RATE_RECOVERY_STEP = float(os.getenv("RATE_RECOVERY_STEP", 0.05))
+# 速率下限（占配置速率的比例）
+RATE_MIN_RATIO = 0.1
+# 火山引擎视觉接口在响应体中返回的限流错误码
+THROTTLE_CODES = {50429, 50430}
+
+_semaphores = {}
+_buckets = {}
+_registry_lock = threading.Lock()
+
+
+class RateLimited(Exception):
+    """接口限流（HTTP 429 或限流错误码），retry_after 为服务端要求的等待秒数"""
+
+    def __init__(self, endpoint, retry_after=None):
+        super().__init__(f"{endpoint} 接口限流，retry_after={retry_after}")
+        self.endpoint = endpoint
+        self.retry_after = retry_after
+
+
+class ApiSlots:
+    """进程内共享的接口请求名额：线程阻塞等待，协程等待释放通知（不阻塞事件循环，也不轮询）"""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self._free = limit
+        self._cond = threading.Condition()
+        # 等待名额的协程：(事件循环, Future)
+        self._waiters = []
+
+    def acquire(self):
+        with self._cond:
+            while self._free <= 0:
+                self._cond.wait()
+            self._free -= 1
+
+    async def acquire_async(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._cond:
+                if self._free > 0:
+                    self._free -= 1
+                    return
+                waiter = (loop, loop.create_future())
+                self._waiters.append(waiter)
+            try:
+                # 被唤醒后重新竞争名额，可能被其他线程或协程抢先
+                await waiter[1]
+            finally:
+                with self._cond:
+                    if waiter in self._waiters:
+                        self._waiters.remove(waiter)
+
+    def release(self):
+        with self._cond:
+            if self._free >= self.limit:
+                raise ValueError("名额释放次数多于占用次数")
+            self._free += 1
+            self._cond.notify()
+            waiters, self._waiters = self._waiters, []
+        for loop, future in waiters:
+            try:
+                loop.call_soon_threadsafe(_wake, future)
+            except RuntimeError:
+                # 事件循环已关闭
+                pass
+
+
+def _wake(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class TokenBucket:
+    """令牌桶限速器，被限流时按 AIMD 自适应降低速率并暂停发放令牌"""
+
+    def __init__(self, rate, burst=None):
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst or max(1.0, rate)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        # 最近一次降速的时间：此前发出的请求返回的限流不再重复降速
+        self._last_cut = float("-inf")
+        self._lock = threading.Lock()
+
+    def _reserve(self):
+        """尝试取一个令牌，返回需要等待的秒数（0表示已取得）"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if now < self._paused_until:
+                return self._paused_until - now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0
+            return (1 - self._tokens) / self.rate
+
+    def acquire(self):
+        """阻塞直到取得令牌"""
+        while True:
+            delay = self._reserve()
+            if delay <= 0:
+                return
+            time.sleep(delay)
+
+    async def acquire_async(self):
+        """取得令牌前不阻塞事件循环"""
+        while True:
+            delay = self._reserve()
+            if delay <= 0:
+                return
+            await asyncio.sleep(delay)
+
+    def penalize(self, retry_after=None, issued_at=None):
+        """被限流：降低速率、清空令牌，并在 retry_after（或一个令牌间隔）内暂停发放
+
+        并发请求同时被限流时只降速一次：暂停期间、或请求发出（issued_at，time.monotonic）早于上次降速时，
+        只按 retry_after 延长暂停，不再降低速率
+        """
+        with self._lock:
+            now = time.monotonic()
+            if now < self._paused_until or (issued_at is not None and issued_at < self._last_cut):
+                if retry_after is not None:
+                    self._paused_until = max(self._paused_until, now + retry_after)
+                return
+            self.rate = max(self.max_rate * RATE_MIN_RATIO, self.rate * RATE_BACKOFF_FACTOR)
+            self._tokens = 0
+            self._last_cut = now
+            pause = retry_after if retry_after is not None else 1 / self.rate
+            self._paused_until = max(self._paused_until, now + pause)
+            logger.warning(f"接口限流，速率降至 {self.rate:.2f}/s，暂停 {pause:.1f}s")
+
+    def reward(self):
+        """请求成功：逐步恢复到配置速率"""
+        if self.rate < self.max_rate:
+            with self._lock:
+                self.rate = min(self.max_rate, self.rate + self.max_rate * RATE_RECOVERY_STEP)
+
+
+def _semaphore(endpoint):
+    """获取接口对应的请求名额，未配置或不限制时返回None"""
+    limit = API_CONCURRENCY.get(endpoint, 0)
+    if limit <= 0:
+        return None
+    with _registry_lock:
+        if endpoint not in _semaphores:
+            _semaphores[endpoint] = ApiSlots(limit)
+        return _semaphores[endpoint]
+
+
+def get_bucket(endpoint):
+    """获取接口对应的令牌桶（进程内共享），未配置或不限制时返回None"""
+    rate = API_RATE.get(endpoint, 0)
+    if rate <= 0:
+        return None
+    with _registry_lock:
+        if endpoint not in _buckets:
+            _buckets[endpoint] = TokenBucket(rate, API_BURST.get(endpoint))
+        return _buckets[endpoint]
+
+
+def parse_retry_after(value):
+    """解析 Retry-After 头（秒数或HTTP日期），无法解析时返回None"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def throttled(endpoint, retry_after=None, issued_at=None):
+    """记录一次限流（降低该接口的速率）并返回待抛出的 RateLimited 异常"""
+    bucket = get_bucket(endpoint)
+    if bucket:
+        bucket.penalize(retry_after, issued_at)
+    return RateLimited(endpoint, retry_after)
+
+
+def _throttle_from(endpoint, exc, issued_at=None):
+    """识别HTTP 429异常（requests、httpx、openai），返回 RateLimited，否则返回None"""
+    if isinstance(exc, RateLimited):
+        return None
+    response = getattr(exc, "response", None)
+    status = getattr(exc, "status_code", None) or getattr(response, "status_code", None)
+    if status != 429:
+        return None
+    headers = getattr(response, "headers", None) or {}
+    return throttled(endpoint, parse_retry_after(headers.get("Retry-After")), issued_at)
+
+
+@contextmanager
+def concurrency_slot(endpoint):
+    """占用一个接口请求名额，名额用尽时阻塞等待（所有线程、所有绘本共享）"""
+    semaphore = _semaphore(endpoint)
+    if semaphore is None:
+        yield
+        return
+    semaphore.acquire()
+    try:
+        yield
+    finally:
+        semaphore.release()
+
+
+@contextmanager
+def rate_limited(endpoint):
+    """按令牌桶限速发起请求；请求抛出HTTP 429时降速并转换为 RateLimited，成功时逐步恢复速率"""
+    bucket = get_bucket(endpoint)
+    if bucket:
+        bucket.acquire()
+    issued_at = time.monotonic()
+    try:
+        yield
+    except Exception as e:
+        limited = _throttle_from(endpoint, e, issued_at)
+        if limited:
+            raise limited from e
+        raise
+    if bucket:
+        bucket.reward()
+
+
+@contextmanager
+def api_slot(endpoint):
+    """并发名额 + 速率限制"""
+    with concurrency_slot(endpoint), rate_limited(endpoint):
+        yield
+
+
+@asynccontextmanager
+async def async_api_slot(endpoint):
+    """api_slot 的异步版本，等待期间不阻塞事件循环"""
+    semaphore = _semaphore(endpoint)
+    if semaphore is not None:
+        await semaphore.acquire_async()
+    try:
+        bucket = get_bucket(endpoint)
+        if bucket:
+            await bucket.acquire_async()
+        issued_at = time.monotonic()
+        try:
+            yield
+        except Exception as e:
+            limited = _throttle_from(endpoint, e, issued_at)
+            if limited:
+                raise limited from e
+            raise
+        if bucket:
+            bucket.reward()
+    finally:
+        if semaphore is not None:
+            semaphore.release()
+
+
+def wait_rate_limited(fallback):
+    """tenacity 等待策略：限流时按 Retry-After（或令牌间隔）加少量抖动等待，其他错误使用 fallback"""
+    def wait(retry_state):
+        exc = retry_state.outcome.exception() if retry_state.outcome else None
+        if not isinstance(exc, RateLimited):
+            return fallback(retry_state)
+        if exc.retry_after is not None:
+            delay = exc.retry_after
+        else:
+            bucket = get_bucket(exc.endpoint)
+            delay = 1 / bucket.rate if bucket else 1.0
+        return delay + random.uniform(0, 0.5)
+    return wait
+
+
+def give_up(retry_state):
+    """tenacity 重试用尽时的回调：记录日志并返回None（与生成函数失败时的返回值一致）"""
+    logger.error(f"重试次数用尽：{retry_state.outcome.exception()}")
+    return None
@@ -0,0 +1,91 @@
+# utils/story_cache.py
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# 故事缓存配置
+STORY_CACHE_DIR = os.getenv("STORY_CACHE_DIR", ".cache/stories")
+STORY_CACHE_TTL = int(os.getenv("STORY_CACHE_TTL", 7 * 24 * 3600))  # 秒，0表示永不过期
+STORY_CACHE_MAX_ENTRIES = int(os.getenv("STORY_CACHE_MAX_ENTRIES", 500))
+
+
+def make_key(*parts):
+    """根据提示词、模型与采样参数计算内容哈希"""
+    payload = json.dumps(parts, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class StoryCache:
+    """基于磁盘的故事缓存（内容寻址，支持TTL与条目数淘汰）"""
+
+    def __init__(self, cache_dir=STORY_CACHE_DIR, ttl=STORY_CACHE_TTL, max_entries=STORY_CACHE_MAX_ENTRIES):
+        self.cache_dir = Path(cache_dir)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, key):
+        return self.cache_dir / f"{key}.json"
+
+    def get(self, key):
+        """读取缓存，未命中或已过期返回None"""
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+        if self.ttl and time.time() - entry.get("created_at", 0) > self.ttl:
+            path.unlink(missing_ok=True)
+            return None
+
+        # 更新访问时间，淘汰时优先保留常用条目
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return entry["story"]
+
+    def set(self, key, story):
+        """写入缓存（先写临时文件再原子替换）"""
+        path = self._path(key)
+        tmp_path = path.with_name(f"{path.name}.{threading.get_ident()}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"created_at": time.time(), "story": story}, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        self._evict()
+
+    def _evict(self):
+        """超过条目上限时按最近访问时间淘汰"""
+        if not self.max_entries:
+            return
+        with self._lock:
+            try:
+                entries = sorted(self.cache_dir.glob("*.json"), key=lambda p: p.stat().st_mtime)
+            except FileNotFoundError:
+                return
+            for path in entries[:max(0, len(entries) - self.max_entries)]:
+                path.unlink(missing_ok=True)
+                logger.info(f"故事缓存已淘汰：{path.name}")
+
+
+_story_cache = None
+_story_cache_lock = threading.Lock()
+
+
+def get_story_cache():
+    """获取进程内共享的故事缓存"""
+    global _story_cache
+    if _story_cache is None:
+        with _story_cache_lock:
+            if _story_cache is None:
+                _story_cache = StoryCache()
+    return _story_cache
@@ -0,0 +1,89 @@
+# utils/text_wrap.py
+import re
+import threading
+
+# 中日韩文字、全角标点：每个字符都可以作为换行点
+_CJK_RANGES = "\u2e80-\u9fff\uac00-\ud7af\uf900-\ufaff\ufe30-\ufe4f\uff00-\uffef"
+_TOKEN_RE = re.compile(rf"[{_CJK_RANGES}]|\s+|[^\s{_CJK_RANGES}]+")
+
+# 不能出现在行首的标点（避头尾）
+NO_LINE_START = set("，。、；：！？）》」』】〕…,.;:!?)]}%")
+
+_advance_cache = {}
+_advance_lock = threading.Lock()
+
+
+def _font_key(font):
+    """字体缓存键：TrueType字体按 (路径, 字号, 索引)，其他字体按对象ID"""
+    path = getattr(font, "path", None)
+    if path:
+        return (path, font.size, getattr(font, "index", 0))
+    return id(font)
+
+
+def _advances(font):
+    """获取字体的字形宽度表（每个字体共用一张表，逐字填充）"""
+    key = _font_key(font)
+    table = _advance_cache.get(key)
+    if table is None:
+        with _advance_lock:
+            table = _advance_cache.setdefault(key, {})
+    return table
+
+
+def measure(text, font):
+    """按缓存的字形宽度累加计算文本宽度（忽略字距调整）"""
+    table = _advances(font)
+    width = 0.0
+    for ch in text:
+        advance = table.get(ch)
+        if advance is None:
+            advance = table[ch] = font.getlength(ch)
+        width += advance
+    return width
+
+
+def wrap_text(text, font, max_width):
+    """单次线性扫描完成换行：中日韩文字按字符断行，西文按空格断行，保留显式换行符
+
+    超过一行宽度的长单词按字符强制断开；行首标点并入上一行
+    """
+    lines = []
+    for paragraph in text.split("\n"):
+        line = []
+        line_width = 0.0
+
+        for match in _TOKEN_RE.finditer(paragraph):
+            token = match.group()
+            token_width = measure(token, font)
+
+            if token.isspace():
+                # 行首空白直接丢弃
+                if line:
+                    line.append(token)
+                    line_width += token_width
+                continue
+
+            if line_width + token_width <= max_width:
+                line.append(token)
+                line_width += token_width
+            elif token in NO_LINE_START and line:
+                # 标点不放在行首，允许本行略微超宽
+                line.append(token)
+                line_width += token_width
+            elif token_width > max_width:
+                # 长单词按字符拆分
+                for ch in token:
+                    ch_width = measure(ch, font)
+                    if line and line_width + ch_width > max_width:
+                        lines.append("".join(line).rstrip())
+                        line, line_width = [], 0.0
+                    line.append(ch)
+                    line_width += ch_width
+            else:
+                if line:
+                    lines.append("".join(line).rstrip())
+                line, line_width = [token], token_width
+
+        lines.append("".join(line).rstrip())
+    return lines